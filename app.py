@@ -2,63 +2,181 @@
 """This is the application entrypoint.
 Jalapeño and SL-API usage is abstracted in app_lib.
 """
-import threading
 import logging
 import json
 import time
-from app_lib import SLAPIWrapper
+from app_lib import RouterRegistry
 from app_lib import Jalapeno
+from app_lib import TopologyCache
+from app_lib import ArangoChangeFeed
+from app_lib import SyntheticChangeFeed
+from app_lib import RecomputeScheduler
+from app_lib import SteeringEngine
+from app_lib import RouterSteering
+from app_lib import SLMplsWrapper
+from app_lib import BindingSids
+from app_lib import SLBfdWrapper
+from app_lib import SLInterfaceWrapper
+from app_lib import SLRouteStream
+from app_lib import PathStabilityPolicy
 
 
 def main():
     logging.basicConfig(level=logging.DEBUG)
     logging.info("Starting SR-App")
     config = load_config()
-    lets_get_thready = threading.Event()
     jalapeno = Jalapeno(**config["jalapeno"])
-    sl_api = SLAPIWrapper(config["SL-API"]["netloc"], lets_get_thready)
-    try:
-        sl_api.vrf_cleanup()
-        last_route = None
-        while True:
-            logging.debug("Polling for optimal path...")
-            optimal_path = jalapeno.get_least_utilized_path(
-                config["path"]["srcGatewayIP"], config["path"]["dstGatewayIP"]
+    scheduler = RecomputeScheduler(
+        debounce=config.get("debounce", 0.5),
+        min_interval=config.get("min_recompute_interval", 1),
+    )
+    topology = None
+    change_feed = None
+    use_cache = config.get("topology_cache", False)
+    if config.get("change_feed") is not None and not use_cache:
+        raise ValueError("change_feed needs topology_cache.")
+    if use_cache:
+        # Compute paths locally, only weights are fetched per poll.
+        topology = TopologyCache(jalapeno)
+        topology.load()
+        change_feed = load_change_feed(config, topology, scheduler.notify)
+    if change_feed is None:
+        # Nothing tells us about changes, fall back to timed polling.
+        scheduler.poll_time = config["poll_time"]
+    registry = load_routers(config["SL-API"])
+    restart_mode = config["SL-API"].get("restart_mode", "reconcile")
+
+    def steering_engine(sl_api, flows):
+        binding_sids = None
+        if "mpls" in config:
+            mpls = SLMplsWrapper(
+                sl_api,
+                start_label=config["mpls"].get("start_label", 24000),
+                block_size=config["mpls"].get("block_size", 1000),
             )
-            # Derive the SL-API route form of what Jalapeño returns.
-            optimal_route = {
-                "prefix": config["path"]["srcIP"],
-                "nexthop_ip": optimal_path[0]["ToInterfaceIP"],
-                "nexthop_intf": optimal_path[0]["FromInterfaceName"],
-                "label_stack": [int(e["RemotePrefixSID"]) for e in optimal_path[1:]],
-            }
-            logging.debug(
-                "Optimal route: %s -> %s %s",
-                optimal_route["prefix"],
-                optimal_route["nexthop_ip"],
-                str(optimal_route["label_stack"]),
+            binding_sids = BindingSids(
+                mpls,
+                config["mpls"]["binding_nexthop_ip"],
+                config["mpls"]["binding_nexthop_intf"],
             )
-            if optimal_route != last_route:
-                logging.info("New optimal route for %s!", optimal_route["prefix"])
-                if last_route is not None:
-                    logging.debug("Removing previous optimaal route.")
-                    sl_api.route_remove(**last_route)
-                logging.debug("Adding latest optimal route.")
-                sl_api.route_add(**optimal_route)
-                last_route = optimal_route
-            else:
-                logging.debug("Optimal route same as previous, nothing to do.")
-            logging.debug("Sleeping for %i seconds.", config["poll_time"])
-            time.sleep(config["poll_time"])
+        stability = None
+        if "stability" in config:
+            stability = PathStabilityPolicy(**config["stability"])
+        bfd = None
+        if "bfd" in config:
+            bfd = SLBfdWrapper(sl_api, **config["bfd"])
+        interfaces = None
+        if config.get("interface_events", False):
+            interfaces = SLInterfaceWrapper(sl_api, config.get("interface_names"))
+        route_stream = None
+        if "route_stream" in config["SL-API"]:
+            route_stream = SLRouteStream(sl_api, **config["SL-API"]["route_stream"])
+        return SteeringEngine(
+            sl_api, flows, binding_sids, stability, bfd, interfaces, route_stream
+        )
+
+    steering = None
+    try:
+        steering = RouterSteering(
+            registry, load_flows(config), steering_engine, restart_mode
+        )
+        # EOF is only sent once the desired state is on the router, so it
+        # purges just the stale routes we no longer want.
+        steering.register()
+        scheduler.wait()
+        steering.run_cycle(
+            update_path_source(jalapeno, topology, change_feed),
+            replay=restart_mode == "replay",
+        )
+        steering.eof()
+        while scheduler.wait():
+            logging.debug("Computing optimal paths...")
+            steering.run_cycle(update_path_source(jalapeno, topology, change_feed))
     except KeyboardInterrupt:
         logging.warning("Shutting down due to user interrupt!")
     except:
         logging.exception("Unexpected exception!")
     finally:
-        # TODO: Ideally move this implicitly into SL-API wrapper
-        logging.info("Setting exit flag - will clean up on SL-API heartbeat.")
-        lets_get_thready.set()
-        sl_api.watchdog_thread.join()
+        # One deadline for the whole shutdown.
+        close_timeout = config["SL-API"].get("close_timeout", 5)
+        deadline = time.monotonic() + close_timeout
+        if steering is not None:
+            steering.cleanup(close_timeout)
+        logging.info("Closing SL-API sessions.")
+        registry.close(max(deadline - time.monotonic(), 0))
+        if change_feed is not None:
+            change_feed.stop()
+        scheduler.stop()
+
+
+def update_path_source(jalapeno, topology, change_feed):
+    """Bring the path source up to date and return it."""
+    if change_feed is not None:
+        change_feed.apply()
+        return topology
+    if topology is not None:
+        topology.refresh_weights()
+        return topology
+    return jalapeno
+
+
+def load_change_feed(config, topology, listener):
+    """Start the configured topology change feed, if any."""
+    feed_type = config.get("change_feed")
+    if feed_type == "arango":
+        change_feed = ArangoChangeFeed(topology, listener)
+    elif feed_type == "synthetic":
+        change_feed = SyntheticChangeFeed(
+            topology, listener, interval=config["poll_time"]
+        )
+    elif feed_type is None:
+        return None
+    else:
+        raise ValueError("Unknown change_feed %s" % feed_type)
+    change_feed.start()
+    return change_feed
+
+
+def load_routers(sl_api_config):
+    """SL-API session per headend listed under "routers" by srcGatewayIP,
+    netloc is the session for every other headend.
+    """
+    registry = RouterRegistry()
+    vrfs = sl_api_config.get("vrfs")
+    channel = sl_api_config.get("channel")
+    liveness = sl_api_config.get("liveness")
+    unregister_on_exit = sl_api_config.get("unregister_on_exit", False)
+    try:
+        for gateway, router in sl_api_config.get("routers", {}).items():
+            registry.add(
+                gateway,
+                router["netloc"],
+                vrfs=router.get("vrfs", vrfs),
+                channel=router.get("channel", channel),
+                liveness=router.get("liveness", liveness),
+                unregister_on_exit=unregister_on_exit,
+            )
+        if "netloc" in sl_api_config:
+            registry.add(
+                None,
+                sl_api_config["netloc"],
+                vrfs=vrfs,
+                channel=channel,
+                liveness=liveness,
+                unregister_on_exit=unregister_on_exit,
+            )
+    except:
+        # Sessions already added would keep the process alive.
+        registry.close(sl_api_config.get("close_timeout", 5))
+        raise
+    return registry
+
+
+def load_flows(config):
+    """Flows to steer, a single "path" is still accepted as one flow."""
+    if "flows" in config:
+        return config["flows"]
+    return [config["path"]]
 
 
 def load_config(filename="config.json"):
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+"""asyncio entrypoint, takes the same config.json as app.py.
+Path queries, route pushes and SL-API notifications share one event loop.
+"""
+import asyncio
+import logging
+from app import load_config
+from app import load_flows
+from app_lib import PathStabilityPolicy
+from app_lib import SteeringEngine
+from app_lib.aio_sl_api import AsyncSLAPIWrapper
+from app_lib.aio_jalapeno import AsyncJalapeno
+
+
+def main():
+    logging.basicConfig(level=logging.DEBUG)
+    logging.info("Starting SR-App (asyncio)")
+    config = load_config()
+    try:
+        asyncio.run(main_async(config))
+    except KeyboardInterrupt:
+        logging.warning("Shutting down due to user interrupt!")
+
+
+async def main_async(config):
+    if (
+        "mpls" in config
+        or "bfd" in config
+        or config.get("interface_events", False)
+        or config.get("topology_cache", False)
+    ):
+        logging.warning(
+            "Binding SIDs, BFD, interface events and the topology cache need "
+            "app.py, ignoring."
+        )
+    if "routers" in config["SL-API"]:
+        # One session per event loop, many headends need app.py.
+        raise ValueError("SL-API.routers needs app.py, set only SL-API.netloc.")
+    jalapeno = AsyncJalapeno(**config["jalapeno"])
+    sl_api = AsyncSLAPIWrapper(
+        config["SL-API"]["netloc"],
+        vrfs=config["SL-API"].get("vrfs"),
+        channel=config["SL-API"].get("channel"),
+        unregister_on_exit=config["SL-API"].get("unregister_on_exit", False),
+    )
+    restart_mode = config["SL-API"].get("restart_mode", "reconcile")
+    stability = None
+    if "stability" in config:
+        stability = PathStabilityPolicy(**config["stability"])
+    steering = SteeringEngine(sl_api, load_flows(config), stability=stability)
+    try:
+        await sl_api.start()
+        # As in app.py, EOF only once the desired state is on the router.
+        await asyncio.gather(
+            *(
+                sl_api.vrf_register(vrf_name, address_family)
+                for vrf_name, address_family in steering.vrf_address_families()
+            )
+        )
+        if restart_mode == "reconcile":
+            await steering.load_installed_async()
+        await steering.run_cycle_async(jalapeno, replay=restart_mode == "replay")
+        await asyncio.gather(
+            *(
+                sl_api.vrf_eof(vrf_name, address_family)
+                for vrf_name, address_family in steering.vrf_address_families()
+            )
+        )
+        while not await wait_exit(sl_api.exit_event, config["poll_time"]):
+            logging.debug("Computing optimal paths...")
+            await steering.run_cycle_async(jalapeno)
+        logging.warning("SL-API session ended, exiting.")
+    except asyncio.CancelledError:
+        raise
+    except:
+        logging.exception("Unexpected exception!")
+    finally:
+        await sl_api.close(config["SL-API"].get("close_timeout", 5))
+        await jalapeno.close()
+
+
+async def wait_exit(exit_event, timeout):
+    """Sleep up to timeout seconds, True if exit_event was set."""
+    try:
+        await asyncio.wait_for(exit_event.wait(), timeout)
+    except asyncio.TimeoutError:
+        pass
+    return exit_event.is_set()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,18 @@
-"""Jalapeno and SL-API wrappers."""
+"""Jalapeno and SL-API wrappers.
+The asyncio wrappers need aiohttp and grpc.aio, import them from
+app_lib.aio_sl_api and app_lib.aio_jalapeno.
+"""
 from .jalapeno import Jalapeno
 from .sl_api import SLAPIWrapper
+from .route_stream import SLRouteStream
+from .topology import TopologyCache
+from .change_feed import ArangoChangeFeed, SyntheticChangeFeed
+from .scheduler import RecomputeScheduler
+from .steering import SteeringEngine, RouterSteering
+from .reconciler import RouteReconciler
+from .mpls import SLMplsWrapper, BindingSids
+from .bfd import SLBfdWrapper
+from .interfaces import SLInterfaceWrapper
+from .paths import PathTable, AlternatePaths
+from .stability import PathStabilityPolicy
+from .routers import RouterRegistry
@@ -0,0 +1,93 @@
+"""asyncio variant of the Jalapeño wrapper using the ArangoDB HTTP API."""
+import aiohttp
+
+from .jalapeno import Jalapeno
+
+
+class AsyncJalapeno:
+    """Same path queries as Jalapeno as coroutines, over one aiohttp session.
+    Needs to be closed on exit.
+    """
+
+    def __init__(
+        self,
+        netloc,
+        username,
+        password,
+        db_name="jalapeno",
+        graph="LSv4_Topology",
+        weight_attribute="Percent_Util_Outbound",
+    ):
+        self.cursor_url = "%s/_db/%s/_api/cursor" % (netloc.rstrip("/"), db_name)
+        self.session = aiohttp.ClientSession(auth=aiohttp.BasicAuth(username, password))
+        self.graph = graph
+        self.weight_attribute = weight_attribute
+
+    async def close(self):
+        await self.session.close()
+
+    async def query(self, query, bind_vars, batch_size=None):
+        """Run an AQL query and return all results, following the cursor."""
+        body = {"query": query, "bindVars": bind_vars}
+        if batch_size:
+            body["batchSize"] = batch_size
+        async with self.session.post(self.cursor_url, json=body) as response:
+            result = await self.__cursor_result(response)
+        results = result["result"]
+        while result.get("hasMore"):
+            async with self.session.put(
+                "%s/%s" % (self.cursor_url, result["id"])
+            ) as response:
+                result = await self.__cursor_result(response)
+            results.extend(result["result"])
+        return results
+
+    async def __cursor_result(self, response):
+        result = await response.json()
+        if result.get("error"):
+            raise RuntimeError(
+                "ArangoDB query failed %s: %s"
+                % (result.get("errorNum"), result.get("errorMessage"))
+            )
+        return result
+
+    async def get_least_utilized_path(self, src_ip, dst_ip):
+        return await self.query(
+            Jalapeno.LEAST_UTILIZED_PATH_QUERY,
+            {
+                "src": "LSNode/%s" % src_ip,
+                "dst": "LSNode/%s" % dst_ip,
+                "@graph": self.graph,
+                "weight": self.weight_attribute,
+            },
+        )
+
+    async def get_least_utilized_paths(self, pairs):
+        """Returns a dict of (src_ip, dst_ip) -> path, from a single query."""
+        pairs = list(dict.fromkeys(tuple(pair) for pair in pairs))
+        if not pairs:
+            return {}
+        results = await self.query(
+            Jalapeno.LEAST_UTILIZED_PATHS_QUERY,
+            {"pairs": pairs, "@graph": self.graph, "weight": self.weight_attribute},
+            batch_size=len(pairs),
+        )
+        return {(src_ip, dst_ip): path for src_ip, dst_ip, path in results}
+
+    async def get_path_weights(self, paths):
+        """Current edge weights of previously returned paths, as in Jalapeno."""
+        keys = list(paths)
+        if not keys:
+            return {}
+        results = await self.query(
+            Jalapeno.PATH_WEIGHTS_QUERY,
+            {
+                "paths": [[edge["_id"] for edge in paths[key]] for key in keys],
+                "weight": self.weight_attribute,
+            },
+            batch_size=len(keys),
+        )
+        return {
+            key: None if None in weights else [weight[0] for weight in weights]
+            for key, weights in zip(keys, results)
+        }
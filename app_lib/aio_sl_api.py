@@ -0,0 +1,295 @@
+"""asyncio variant of the SL-API wrapper on a grpc.aio channel.
+The notification stream runs as a task instead of a watchdog thread, and
+route messages are sent concurrently from the event loop.
+"""
+import asyncio
+import logging
+
+import grpc
+
+from .proto import sl_global_pb2_grpc
+from .proto import sl_global_pb2
+from .proto import sl_common_types_pb2
+from .proto import sl_version_pb2
+from .proto import sl_route_common_pb2
+from .sl_api import (
+    ROUTE_AFIS,
+    create_channel,
+    group_routes,
+    log_vrf_result,
+    route_from_message,
+    route_limits,
+    route_messages,
+    route_compression,
+    route_results,
+    vrf_reg_message,
+)
+
+
+class AsyncSLAPIWrapper:
+    """Same operations as SLAPIWrapper as coroutines.
+    start() opens the notification stream, close() cancels it, and
+    unregisters if unregister_on_exit is set, without waiting for the next
+    heartbeat.
+    """
+
+    def __init__(
+        self,
+        netloc,
+        vrfs=None,
+        max_in_flight=32,
+        channel=None,
+        unregister_on_exit=False,
+    ):
+        # channel holds the channel settings taken by create_channel.
+        self.channel = create_channel(netloc, channel, aio=True)
+        self.compression = route_compression(channel)
+        self.stub = sl_global_pb2_grpc.SLGlobalStub(self.channel)
+        # VRF name -> {"admin_distance": int, "purge_interval": int}
+        self.vrfs = vrfs or {}
+        # (VRF name, address family) registered with the router, left
+        # registered on close() unless unregister_on_exit is set.
+        self.registered_vrfs = []
+        self.unregister_on_exit = unregister_on_exit
+        # Address family -> route limits
+        self.route_limits = {}
+        # Address family -> stub, (address family, operation) -> RPC
+        self.route_stubs = {}
+        self.route_rpcs = {}
+        # Route messages awaiting a response at any time.
+        self.in_flight = asyncio.Semaphore(max_in_flight)
+        # Set when the router ends the session or the stream fails.
+        self.exit_event = asyncio.Event()
+        self.notif_call = None
+        self.notif_task = None
+
+    async def start(self):
+        """Open the notification stream and wait for the router to be ready."""
+        ready_event = asyncio.Event()
+        self.notif_task = asyncio.ensure_future(self.__notif_main(ready_event))
+        ready = asyncio.ensure_future(ready_event.wait())
+        await asyncio.wait(
+            [ready, self.notif_task], return_when=asyncio.FIRST_COMPLETED
+        )
+        if not ready_event.is_set():
+            ready.cancel()
+            raise RuntimeError("SL-API session failed to initialize.")
+
+    async def __notif_main(self, ready_event):
+        init_msg = sl_global_pb2.SLInitMsg()
+        init_msg.MajorVer = sl_version_pb2.SL_MAJOR_VERSION
+        init_msg.MinorVer = sl_version_pb2.SL_MINOR_VERSION
+        init_msg.SubVer = sl_version_pb2.SL_SUB_VERSION
+        self.notif_call = self.stub.SLGlobalInitNotif(init_msg)
+        try:
+            async for response in self.notif_call:
+                if response.EventType == sl_global_pb2.SL_GLOBAL_EVENT_TYPE_VERSION:
+                    if response.ErrStatus.Status in [
+                        sl_common_types_pb2.SLErrorStatus.SL_SUCCESS,
+                        sl_common_types_pb2.SLErrorStatus.SL_INIT_STATE_CLEAR,
+                        sl_common_types_pb2.SLErrorStatus.SL_INIT_STATE_READY,
+                    ]:
+                        logging.info(
+                            "SL-API Server 0x%x, version %d.%d.%d",
+                            response.ErrStatus.Status,
+                            response.InitRspMsg.MajorVer,
+                            response.InitRspMsg.MinorVer,
+                            response.InitRspMsg.SubVer,
+                        )
+                        ready_event.set()
+                    else:
+                        logging.error(
+                            "SL-API init failure: 0x%x", response.ErrStatus.Status
+                        )
+                        break
+                elif response.EventType == sl_global_pb2.SL_GLOBAL_EVENT_TYPE_HEARTBEAT:
+                    logging.debug("Received SL-API heartbeat.")
+                elif response.EventType == sl_global_pb2.SL_GLOBAL_EVENT_TYPE_ERROR:
+                    if (
+                        sl_common_types_pb2.SLErrorStatus.SL_NOTIF_TERM
+                        == response.ErrStatus.Status
+                    ):
+                        logging.warning("Received SL-API notice to terminate.")
+                        break
+                    logging.error("Error not handled: %s", response)
+                else:
+                    logging.error(
+                        "SL-API initialized with unrecognized response %d",
+                        response.EventType,
+                    )
+                    break
+        except asyncio.CancelledError:
+            logging.info("SL-API notification stream cancelled.")
+        except grpc.RpcError as error:
+            logging.error("SL-API notification stream failed: %s", error)
+        self.exit_event.set()
+
+    async def close(self, timeout=5):
+        """Cancel the notification stream, unregister within timeout seconds
+        if unregister_on_exit is set and close the channel.
+        """
+        if self.notif_call is not None:
+            self.notif_call.cancel()
+        if self.notif_task is not None:
+            await self.notif_task
+        try:
+            if self.unregister_on_exit:
+                await asyncio.wait_for(self.cleanup(timeout), timeout)
+        except asyncio.TimeoutError:
+            logging.warning("SL-API cleanup deadline passed, not unregistering.")
+        except grpc.RpcError as error:
+            logging.error("SL-API cleanup failed: %s", error)
+        await self.channel.close()
+
+    async def cleanup(self, timeout=10):
+        for vrf_name, address_family in self.registered_vrfs:
+            await self.__vrf_operation(
+                sl_common_types_pb2.SL_REGOP_UNREGISTER,
+                vrf_name,
+                address_family,
+                timeout,
+            )
+        self.registered_vrfs = []
+
+    async def vrf_register(self, vrf_name="default", address_family=4, timeout=10):
+        await self.__vrf_operation(
+            sl_common_types_pb2.SL_REGOP_REGISTER, vrf_name, address_family, timeout
+        )
+        if (vrf_name, address_family) not in self.registered_vrfs:
+            self.registered_vrfs.append((vrf_name, address_family))
+
+    async def vrf_eof(self, vrf_name="default", address_family=4, timeout=10):
+        await self.__vrf_operation(
+            sl_common_types_pb2.SL_REGOP_EOF, vrf_name, address_family, timeout
+        )
+
+    def vrf_settings(self, vrf_name):
+        """Admin distance and stale route purge interval for the VRF."""
+        settings = {"admin_distance": 2, "purge_interval": 500}
+        settings.update(self.vrfs.get(vrf_name, {}))
+        return settings
+
+    async def __vrf_operation(self, oper, vrf_name, address_family, timeout):
+        vrfMsg = vrf_reg_message(oper, vrf_name, self.vrf_settings(vrf_name))
+        response = await self.route_rpc(address_family, "VrfRegOp")(
+            vrfMsg, timeout=timeout
+        )
+        log_vrf_result(oper, vrf_name, address_family, response)
+
+    async def get_route_limits(self, address_family=4, timeout=10):
+        """Query the router route limits. Cached after first query."""
+        if address_family in self.route_limits:
+            return self.route_limits[address_family]
+        route_globals, global_globals = await asyncio.gather(
+            self.route_rpc(address_family, "GlobalsGet")(
+                sl_route_common_pb2.SLRouteGlobalsGetMsg(), timeout=timeout
+            ),
+            self.stub.SLGlobalsGet(sl_global_pb2.SLGlobalsGetMsg(), timeout=timeout),
+        )
+        self.route_limits[address_family] = route_limits(
+            address_family, route_globals, global_globals
+        )
+        return self.route_limits[address_family]
+
+    async def routes_add(self, routes, vrf_name="default", timeout=10):
+        return await self.__routes_operation(
+            sl_common_types_pb2.SL_OBJOP_ADD, routes, vrf_name, timeout
+        )
+
+    async def routes_update(self, routes, vrf_name="default", timeout=10):
+        return await self.__routes_operation(
+            sl_common_types_pb2.SL_OBJOP_UPDATE, routes, vrf_name, timeout
+        )
+
+    async def routes_remove(self, routes, vrf_name="default", timeout=10):
+        return await self.__routes_operation(
+            sl_common_types_pb2.SL_OBJOP_DELETE, routes, vrf_name, timeout
+        )
+
+    async def __routes_operation(self, oper, routes, vrf_name, timeout):
+        """Send all route messages concurrently, up to max_in_flight at once."""
+        sends = []
+        for (route_vrf, address_family), vrf_routes in group_routes(
+            routes, vrf_name
+        ).items():
+            limits = await self.get_route_limits(address_family, timeout)
+            admin_distance = self.vrf_settings(route_vrf)["admin_distance"]
+            for batch, rtMsg in route_messages(
+                oper, route_vrf, address_family, vrf_routes, limits, admin_distance
+            ):
+                sends.append(
+                    self.__send_route_message(
+                        oper, address_family, batch, rtMsg, timeout
+                    )
+                )
+        results = {}
+        for batch_results in await asyncio.gather(*sends):
+            results.update(batch_results)
+        return results
+
+    async def __send_route_message(self, oper, address_family, batch, rtMsg, timeout):
+        async with self.in_flight:
+            response = await self.route_rpc(address_family, "Op")(
+                rtMsg, timeout=timeout, compression=self.compression
+            )
+        return route_results(oper, batch, response)
+
+    async def routes_get(self, vrf_name="default", address_family=4, timeout=60):
+        """Read all routes installed in the VRF, paging with GetNext over a
+        single get stream. Returns route dicts as taken by routes_add.
+        """
+        afi = ROUTE_AFIS[address_family]
+        limits = await self.get_route_limits(address_family)
+        call = self.route_rpc(address_family, "GetStream")(timeout=timeout)
+        getMsg = afi.get_msg()
+        getMsg.VrfName = vrf_name
+        getMsg.EntriesCount = limits["max_routes"]
+        await call.write(getMsg)
+        routes = []
+        while True:
+            response = await call.read()
+            if response is grpc.aio.EOF:
+                break
+            if (
+                sl_common_types_pb2.SLErrorStatus.SL_SUCCESS
+                != response.ErrStatus.Status
+            ):
+                logging.error(
+                    "Route get failure 0x%x for VRF %s",
+                    response.ErrStatus.Status,
+                    vrf_name,
+                )
+                break
+            routes.extend(
+                route_from_message(entry, vrf_name) for entry in response.Entries
+            )
+            if response.Eof or not response.Entries:
+                break
+            # Next page starts after the last route received.
+            getMsg = afi.get_msg()
+            getMsg.VrfName = vrf_name
+            getMsg.Prefix = response.Entries[-1].Prefix
+            getMsg.PrefixLen = response.Entries[-1].PrefixLen
+            getMsg.EntriesCount = limits["max_routes"]
+            getMsg.GetNext = True
+            await call.write(getMsg)
+        call.cancel()
+        logging.info(
+            "Read %i installed IPv%i routes in VRF %s.",
+            len(routes),
+            address_family,
+            vrf_name,
+        )
+        return routes
+
+    def route_rpc(self, address_family, operation):
+        """Route service RPC by operation, made once per channel."""
+        rpc = self.route_rpcs.get((address_family, operation))
+        if rpc is None:
+            afi = ROUTE_AFIS[address_family]
+            stub = self.route_stubs.get(address_family)
+            if stub is None:
+                stub = self.route_stubs[address_family] = afi.stub(self.channel)
+            rpc = getattr(stub, afi.rpc_prefix + operation)
+            self.route_rpcs[(address_family, operation)] = rpc
+        return rpc
@@ -0,0 +1,307 @@
+"""BFD sessions to first hop neighbors over SL-API.
+Sessions are created for the neighbors steered paths leave the headend
+through, and their state changes are reported from the BFD notification
+stream as they happen instead of on the next path computation.
+"""
+import ipaddress
+import logging
+import threading
+import time
+
+from .notifications import SLNotificationStream
+from .proto import sl_bfd_common_pb2
+from .proto import sl_bfd_ipv4_pb2
+from .proto import sl_bfd_ipv4_pb2_grpc
+from .proto import sl_common_types_pb2
+from .sl_api import OBJECT_OP_NAMES, REG_OP_NAMES
+
+
+class SLBfdWrapper(SLNotificationStream):
+    """IPv4 single hop BFD sessions on the channel of an SLAPIWrapper.
+    start(listener) opens the notification stream, listener(neighbor, up)
+    is then called from the notification thread whenever the session to a
+    neighbor goes down or comes back up. Neighbors count as up until their
+    session is reported down, a new session is reported down if it is
+    admin down or not up within setup_timeout seconds.
+    Needs to be cleaned up on exit.
+    """
+
+    service = "BFD"
+
+    def __init__(
+        self,
+        sl_api,
+        tx_interval_usec=50000,
+        detect_multiplier=3,
+        vrf_name="default",
+        reconnect_backoff=1,
+        max_reconnect_backoff=30,
+        setup_timeout=5,
+    ):
+        super().__init__(reconnect_backoff, max_reconnect_backoff)
+        self.sl_api = sl_api
+        self.tx_interval_usec = tx_interval_usec
+        self.detect_multiplier = detect_multiplier
+        self.vrf_name = vrf_name
+        self.setup_timeout = setup_timeout
+        self.registered = False
+        self.limits = None
+        # (neighbor, interface name) of every session created.
+        self.sessions = set()
+        # Neighbor -> True if its session is up, as last reported.
+        self.states = {}
+        # Neighbor -> timer reporting it down, for sessions not up yet.
+        self.setting_up = {}
+        # Guards states and setting_up against the setup timers.
+        self.lock = threading.Lock()
+
+    def stub(self):
+        """Stub on the current channel, which is rebuilt on reconnection."""
+        return self.sl_api.service_stub(sl_bfd_ipv4_pb2_grpc.SLBfdv4OperStub)
+
+    def register(self, timeout=10):
+        """Register for BFD without EOF, like SLAPIWrapper.vrf_register."""
+        limits = self.get_limits(timeout)
+        if self.tx_interval_usec < limits["min_tx_interval_usec"]:
+            raise ValueError(
+                "BFD transmit interval %i below router minimum %i"
+                % (self.tx_interval_usec, limits["min_tx_interval_usec"])
+            )
+        if self.detect_multiplier < limits["min_detect_multiplier"]:
+            raise ValueError(
+                "BFD detect multiplier %i below router minimum %i"
+                % (self.detect_multiplier, limits["min_detect_multiplier"])
+            )
+        self.__registration(sl_common_types_pb2.SL_REGOP_REGISTER, timeout)
+        self.registered = True
+
+    def eof(self, timeout=10):
+        self.__registration(sl_common_types_pb2.SL_REGOP_EOF, timeout)
+
+    def reset(self):
+        """Forget the sessions and limits, after the SL-API session was
+        re-established and they went with the old registration.
+        """
+        self.limits = None
+        self.sessions = set()
+        with self.lock:
+            for timer in self.setting_up.values():
+                timer.cancel()
+            self.setting_up = {}
+            self.states = {}
+
+    def stop(self, timeout=10):
+        super().stop(timeout)
+        with self.lock:
+            for timer in self.setting_up.values():
+                timer.cancel()
+
+    def cleanup(self, timeout=10):
+        """Stop the notification stream and unregister, removing sessions,
+        within timeout seconds in total.
+        """
+        deadline = time.monotonic() + timeout
+        self.stop(timeout)
+        if self.registered:
+            self.__registration(
+                sl_common_types_pb2.SL_REGOP_UNREGISTER,
+                max(deadline - time.monotonic(), 0),
+            )
+            self.registered = False
+            self.sessions = set()
+
+    def __registration(self, oper, timeout):
+        regMsg = sl_bfd_common_pb2.SLBfdRegMsg()
+        regMsg.Oper = oper
+        response = self.stub().SLBfdv4RegOp(regMsg, timeout)
+        if sl_common_types_pb2.SLErrorStatus.SL_SUCCESS == response.ErrStatus.Status:
+            logging.info("BFD operation successful: %s", REG_OP_NAMES[oper])
+        else:
+            logging.error(
+                "BFD operation failure 0x%x: %s",
+                response.ErrStatus.Status,
+                REG_OP_NAMES[oper],
+            )
+
+    def get_limits(self, timeout=10):
+        """Query the router BFD limits. Cached after first query."""
+        if self.limits is not None:
+            return self.limits
+        response = self.stub().SLBfdv4Get(sl_bfd_common_pb2.SLBfdGetMsg(), timeout)
+        if sl_common_types_pb2.SLErrorStatus.SL_SUCCESS != response.ErrStatus.Status:
+            raise RuntimeError(
+                "SL-API BFD globals failure 0x%x" % response.ErrStatus.Status
+            )
+        self.limits = {
+            "max_sessions": max(response.MaxBfdSessionCfgPerSLBfdMsg, 1),
+            "min_tx_interval_usec": response.MinBfdTxIntervalSingleHop,
+            "min_detect_multiplier": response.MinBfdDetectMultiplierSingleHop,
+        }
+        logging.info(
+            "SL-API BFD limits: %i sessions per message, transmit interval "
+            ">= %i usec, detect multiplier >= %i.",
+            self.limits["max_sessions"],
+            self.limits["min_tx_interval_usec"],
+            self.limits["min_detect_multiplier"],
+        )
+        return self.limits
+
+    def sync(self, first_hops, timeout=10):
+        """Keep one session per first hop, a dict of neighbor -> interface
+        name, creating new sessions and removing unused ones.
+        IPv6 neighbors and neighbors without an interface name are skipped.
+        """
+        wanted = {
+            (neighbor, interface)
+            for neighbor, interface in first_hops.items()
+            if interface and ipaddress.ip_address(neighbor).version == 4
+        }
+        added = wanted - self.sessions
+        removed = self.sessions - wanted
+        if added:
+            # Set up before adding, the first notification may come first.
+            for neighbor, _ in added:
+                self.__start_setup(neighbor)
+            succeeded = self.__sessions_operation(
+                sl_common_types_pb2.SL_OBJOP_ADD, added, timeout
+            )
+            self.sessions |= succeeded
+            for neighbor, _ in added - succeeded:
+                self.__end_setup(neighbor)
+        if removed:
+            gone = self.__sessions_operation(
+                sl_common_types_pb2.SL_OBJOP_DELETE, removed, timeout
+            )
+            self.sessions -= gone
+            for neighbor, _ in gone:
+                self.__end_setup(neighbor)
+                with self.lock:
+                    self.states.pop(neighbor, None)
+
+    def __start_setup(self, neighbor):
+        timer = threading.Timer(self.setup_timeout, self.__setup_expired, [neighbor])
+        timer.daemon = True
+        with self.lock:
+            previous = self.setting_up.pop(neighbor, None)
+            self.setting_up[neighbor] = timer
+        if previous is not None:
+            previous.cancel()
+        timer.start()
+
+    def __end_setup(self, neighbor):
+        """Stop waiting for the session to come up, True if it was."""
+        with self.lock:
+            timer = self.setting_up.pop(neighbor, None)
+        if timer is None:
+            return False
+        timer.cancel()
+        return True
+
+    def __setup_expired(self, neighbor):
+        with self.lock:
+            if self.setting_up.pop(neighbor, None) is None:
+                return
+            self.states[neighbor] = False
+        logging.warning(
+            "BFD session to %s not up in %ss.", neighbor, self.setup_timeout
+        )
+        self.listener(neighbor, False)
+
+    def __sessions_operation(self, oper, sessions, timeout):
+        """Returns the sessions the operation succeeded for."""
+        limits = self.get_limits(timeout)
+        sessions = sorted(sessions)
+        succeeded = set()
+        for offset in range(0, len(sessions), limits["max_sessions"]):
+            batch = sessions[offset : offset + limits["max_sessions"]]
+            bfdMsg = sl_bfd_ipv4_pb2.SLBfdv4Msg()
+            bfdMsg.Oper = oper
+            for neighbor, interface in batch:
+                session = bfdMsg.Sessions.add()
+                session.Key.Type = sl_bfd_common_pb2.SL_BFD_SINGLE_HOP
+                session.Key.VrfName = self.vrf_name
+                session.Key.NbrAddr = int(ipaddress.IPv4Address(neighbor))
+                session.Key.Interface.Name = interface
+                session.Config.DesiredTxIntUsec = self.tx_interval_usec
+                session.Config.DetectMultiplier = self.detect_multiplier
+            response = self.stub().SLBfdv4SessionOp(bfdMsg, timeout)
+            succeeded.update(self.__session_results(oper, batch, response))
+        return succeeded
+
+    def __session_results(self, oper, batch, response):
+        summary = response.StatusSummary.Status
+        if sl_common_types_pb2.SLErrorStatus.SL_SUCCESS == summary:
+            logging.info(
+                "BFD session operation successful: %s (%i sessions)",
+                OBJECT_OP_NAMES[oper],
+                len(batch),
+            )
+            return batch
+        if summary != sl_common_types_pb2.SLErrorStatus.SL_SOME_ERR:
+            logging.error(
+                "BFD session operation failure 0x%x: %s",
+                summary,
+                OBJECT_OP_NAMES[oper],
+            )
+            return []
+        # Sessions not listed in Results succeeded, as did adding a session
+        # which already exists or removing one which is already gone.
+        succeeded = set(batch)
+        for result in response.Results:
+            if result.ErrStatus.Status in [
+                sl_common_types_pb2.SLErrorStatus.SL_BFD_SESSION_EXISTS,
+                sl_common_types_pb2.SLErrorStatus.SL_BFD_SESSION_NOT_FOUND,
+            ]:
+                continue
+            session = (
+                str(ipaddress.IPv4Address(result.Key.NbrAddr)),
+                result.Key.Interface.Name,
+            )
+            succeeded.discard(session)
+            logging.error(
+                "BFD session operation failure 0x%x: %s to %s via %s",
+                result.ErrStatus.Status,
+                OBJECT_OP_NAMES[oper],
+                session[0],
+                session[1],
+            )
+        return succeeded
+
+    def open_stream(self):
+        return self.stub().SLBfdv4GetNotifStream(sl_bfd_common_pb2.SLBfdGetNotifMsg())
+
+    def handle_notification(self, notif):
+        if notif.EventType == sl_bfd_common_pb2.SL_BFD_EVENT_TYPE_ERROR:
+            logging.error("BFD notification error 0x%x", notif.ErrStatus.Status)
+            return
+        if notif.EventType != sl_bfd_common_pb2.SL_BFD_EVENT_TYPE_SESSION_STATE:
+            return
+        key = notif.Session.Key
+        neighbor = str(ipaddress.IPv4Address(key.NbrAddr))
+        state = notif.Session.State
+        up = state.Status == sl_bfd_common_pb2.SLBfdCommonState.SL_BFD_SESSION_UP
+        if neighbor in self.setting_up:
+            # A new session starts down, only admin down is final before
+            # the setup timeout.
+            admin_down = (
+                state.Diag == sl_bfd_common_pb2.SLBfdCommonState.SL_BFD_DIAG_ADMIN_DOWN
+            )
+            if not (up or admin_down) or not self.__end_setup(neighbor):
+                return
+        elif (neighbor, key.Interface.Name) not in self.sessions:
+            return
+        with self.lock:
+            # Neighbors never reported on count as up.
+            previous = self.states.get(neighbor, True)
+            self.states[neighbor] = up
+        if previous == up:
+            return
+        if up:
+            logging.info("BFD session to %s is up.", neighbor)
+        else:
+            logging.warning(
+                "BFD session to %s is down, diag %i.",
+                neighbor,
+                notif.Session.State.Diag,
+            )
+        self.listener(neighbor, up)
@@ -0,0 +1,219 @@
+"""Incremental topology updates for TopologyCache.
+Change feeds collect LSNode and topology edge changes in the background,
+notify a listener when something relevant to path computation changed,
+and apply the coalesced changes to the cache on request.
+"""
+import logging
+import random
+import threading
+
+# ArangoDB replication marker types for document writes and removals.
+REPLICATION_MARKER_DOCUMENT = 2300
+REPLICATION_MARKER_REMOVE = 2302
+
+
+class TopologyChangeFeed:
+    """Base change feed, subclasses produce changes via record_change().
+    apply() must be called from the thread using the TopologyCache, the
+    feed thread only reads it under the topology lock.
+    """
+
+    def __init__(self, topology, listener=None):
+        self.topology = topology
+        self.listener = listener
+        self.lock = threading.Lock()
+        self.exit_event = threading.Event()
+        self.feed_thread = None
+        # Latest document per edge _id, None for removed edges.
+        self.pending_edges = {}
+        self.structure_changed = False
+
+    def start(self):
+        self.feed_thread = threading.Thread(target=self.run, daemon=True)
+        self.feed_thread.start()
+
+    def stop(self, timeout=None):
+        self.exit_event.set()
+        if self.feed_thread is not None:
+            self.feed_thread.join(timeout)
+
+    def run(self):
+        raise NotImplementedError
+
+    def record_change(self, collection, doc, removed=False):
+        """Record a changed document, waking the listener if it affects paths."""
+        if collection == "LSNode":
+            relevant = removed or doc["_key"] not in self.topology.node_index
+            if relevant:
+                with self.lock:
+                    self.structure_changed = True
+        elif collection == self.topology.jalapeno.graph:
+            edge_id = "%s/%s" % (collection, doc["_key"])
+            with self.topology.lock:
+                relevant = removed or self.__edge_changed(edge_id, doc)
+            if relevant:
+                with self.lock:
+                    self.pending_edges[edge_id] = None if removed else doc
+        else:
+            return
+        if relevant and self.listener is not None:
+            self.listener()
+
+    def apply(self):
+        """Apply pending changes to the topology. Returns True if any applied."""
+        with self.lock:
+            pending_edges = self.pending_edges
+            structure_changed = self.structure_changed
+            self.pending_edges = {}
+            self.structure_changed = False
+        if not structure_changed:
+            for edge_id, doc in pending_edges.items():
+                if doc is None or self.__edge_moved(edge_id, doc):
+                    structure_changed = True
+                    break
+        if structure_changed:
+            logging.info("Topology structure changed, reloading.")
+            self.topology.load()
+            return True
+        weight_attribute = self.topology.jalapeno.weight_attribute
+        changed = False
+        for edge_id, doc in pending_edges.items():
+            if self.topology.set_edge_weight(edge_id, doc.get(weight_attribute)):
+                changed = True
+        return changed
+
+    def __edge_changed(self, edge_id, doc):
+        position = self.topology.edge_index.get(edge_id)
+        if position is None:
+            return True
+        weight = doc.get(self.topology.jalapeno.weight_attribute)
+        if self.topology.weights[position] != self.topology.edge_weight(weight):
+            return True
+        return self.__edge_moved(edge_id, doc)
+
+    def __edge_moved(self, edge_id, doc):
+        """True if the change is more than a weight change."""
+        position = self.topology.edge_index.get(edge_id)
+        if position is None:
+            return True
+        edge = self.topology.edges[position]
+        return (
+            doc.get("_from")
+            != "LSNode/%s" % self.topology.node_keys[self.topology.sources[position]]
+            or doc.get("_to")
+            != "LSNode/%s" % self.topology.node_keys[self.topology.targets[position]]
+            or any(
+                doc.get(field) != value
+                for field, value in edge.items()
+                if field != "_id"
+            )
+        )
+
+
+class ArangoChangeFeed(TopologyChangeFeed):
+    """Tails the ArangoDB write-ahead log from the last seen tick."""
+
+    def __init__(self, topology, listener=None, poll_interval=1, syncer_id=None):
+        super().__init__(topology, listener)
+        self.db = topology.jalapeno.db
+        self.poll_interval = poll_interval
+        self.syncer_id = syncer_id
+        self.tick = None
+        self.last_scanned = None
+        # WAL entries name collections by globally unique id.
+        self.collection_ids = {}
+        for name in ("LSNode", topology.jalapeno.graph):
+            properties = self.db.collection(name).properties()
+            self.collection_ids[properties["global_id"]] = name
+
+    def start(self):
+        """Checkpoint at the current tick, the topology is loaded from here."""
+        self.tick = self.db.wal.last_tick()["tick"]
+        super().start()
+
+    def run(self):
+        while not self.exit_event.is_set():
+            try:
+                result = self.db.wal.tail(
+                    lower=self.tick,
+                    last_scanned=self.last_scanned,
+                    syncer_id=self.syncer_id,
+                    client_info="sr-app",
+                    deserialize=True,
+                )
+            except Exception:
+                logging.exception("Failed to tail ArangoDB WAL.")
+                self.exit_event.wait(self.poll_interval)
+                continue
+            if not result.get("from_present", True):
+                # Entries were dropped from the WAL before we read them.
+                logging.warning("ArangoDB WAL gap after tick %s.", self.tick)
+                with self.lock:
+                    self.structure_changed = True
+                if self.listener is not None:
+                    self.listener()
+            for entry in result["content"]:
+                try:
+                    self.__handle_entry(entry)
+                except Exception:
+                    # The change may be lost, reload to get back in sync.
+                    logging.exception("Failed to handle ArangoDB WAL entry.")
+                    with self.lock:
+                        self.structure_changed = True
+                    if self.listener is not None:
+                        self.listener()
+            if result.get("last_included", "0") != "0":
+                self.tick = result["last_included"]
+            self.last_scanned = result.get("last_scanned")
+            if not result.get("check_more", False):
+                self.exit_event.wait(self.poll_interval)
+
+    def __handle_entry(self, entry):
+        if entry.get("type") not in (
+            REPLICATION_MARKER_DOCUMENT,
+            REPLICATION_MARKER_REMOVE,
+        ):
+            return
+        collection = entry.get("cname") or self.collection_ids.get(entry.get("cuid"))
+        if collection is None:
+            return
+        self.record_change(
+            collection,
+            entry["data"],
+            removed=entry["type"] == REPLICATION_MARKER_REMOVE,
+        )
+
+
+class SyntheticChangeFeed(TopologyChangeFeed):
+    """Offline stand-in for ArangoChangeFeed.
+    Changes can be injected with record_change(), and with an interval set
+    a random edge gets a random utilization every interval seconds.
+    """
+
+    def __init__(self, topology, listener=None, interval=None, seed=None):
+        super().__init__(topology, listener)
+        self.interval = interval
+        self.random = random.Random(seed)
+
+    def run(self):
+        if self.interval is None:
+            return
+        while not self.exit_event.wait(self.interval):
+            with self.topology.lock:
+                if not self.topology.edge_index:
+                    continue
+                edge_id = self.random.choice(list(self.topology.edge_index))
+                position = self.topology.edge_index[edge_id]
+                edge = self.topology.edges[position]
+                doc = dict(
+                    edge,
+                    _key=edge_id.split("/", 1)[1],
+                    _from="LSNode/%s"
+                    % self.topology.node_keys[self.topology.sources[position]],
+                    _to="LSNode/%s"
+                    % self.topology.node_keys[self.topology.targets[position]],
+                )
+            doc[self.topology.jalapeno.weight_attribute] = round(
+                self.random.uniform(0, 100), 2
+            )
+            self.record_change(self.topology.jalapeno.graph, doc)
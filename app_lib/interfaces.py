@@ -0,0 +1,264 @@
+"""Headend interface table and state over SL-API.
+The headend's interfaces are loaded once and kept fresh from state
+notifications, resolving the interface steered paths leave through
+without device lookups and acting on a local link going down at once.
+"""
+import logging
+import time
+
+from .notifications import SLNotificationStream
+from .proto import sl_common_types_pb2
+from .proto import sl_interface_pb2
+from .proto import sl_interface_pb2_grpc
+from .sl_api import REG_OP_NAMES
+
+
+class SLInterfaceWrapper(SLNotificationStream):
+    """SL-API interface operations on the channel of an SLAPIWrapper.
+    start(listener) opens the notification stream, listener(interface, up)
+    is then called from the notification thread whenever an interface
+    passed to sync() goes down or comes back up.
+    names optionally maps local interface IPs to interface names, for
+    links Jalapeño has no usable FromInterfaceName for.
+    Needs to be cleaned up on exit.
+    """
+
+    service = "Interface"
+
+    def __init__(
+        self, sl_api, names=None, reconnect_backoff=1, max_reconnect_backoff=30
+    ):
+        super().__init__(reconnect_backoff, max_reconnect_backoff)
+        self.sl_api = sl_api
+        self.names = names or {}
+        self.registered = False
+        self.limits = None
+        # Interface name -> (True if up / False if down / None, SeqNum)
+        # for every interface of the headend.
+        self.table = {}
+        # Local interface IP -> name, learned from paths.
+        self.learned = {}
+        self.unresolved = set()
+        # Interface names notifications are enabled for, and reported on.
+        self.enabled = set()
+        self.watched = set()
+
+    def stub(self):
+        """Stub on the current channel, which is rebuilt on reconnection."""
+        return self.sl_api.service_stub(sl_interface_pb2_grpc.SLInterfaceOperStub)
+
+    def register(self, timeout=10):
+        self.__registration(sl_common_types_pb2.SL_REGOP_REGISTER, timeout)
+        self.registered = True
+
+    def reset(self):
+        """Forget the limits and enabled notifications, after the SL-API
+        session was re-established. The table is refreshed by load().
+        """
+        self.limits = None
+        self.enabled = set()
+
+    def cleanup(self, timeout=10):
+        """Stop the notification stream and unregister, within timeout seconds."""
+        deadline = time.monotonic() + timeout
+        self.stop(timeout)
+        if self.registered:
+            self.__registration(
+                sl_common_types_pb2.SL_REGOP_UNREGISTER,
+                max(deadline - time.monotonic(), 0),
+            )
+            self.registered = False
+            self.enabled = set()
+
+    def __registration(self, oper, timeout):
+        regMsg = sl_interface_pb2.SLInterfaceGlobalsRegMsg()
+        regMsg.Oper = oper
+        response = self.stub().SLInterfaceGlobalsRegOp(regMsg, timeout)
+        if sl_common_types_pb2.SLErrorStatus.SL_SUCCESS == response.ErrStatus.Status:
+            logging.info("Interface operation successful: %s", REG_OP_NAMES[oper])
+        else:
+            logging.error(
+                "Interface operation failure 0x%x: %s",
+                response.ErrStatus.Status,
+                REG_OP_NAMES[oper],
+            )
+
+    def get_limits(self, timeout=10):
+        """Query the router interface limits. Cached after first query."""
+        if self.limits is not None:
+            return self.limits
+        response = self.stub().SLInterfaceGlobalsGet(
+            sl_interface_pb2.SLInterfaceGlobalsGetMsg(), timeout
+        )
+        if sl_common_types_pb2.SLErrorStatus.SL_SUCCESS != response.ErrStatus.Status:
+            raise RuntimeError(
+                "SL-API interface globals failure 0x%x" % response.ErrStatus.Status
+            )
+        self.limits = {"max_interfaces": max(response.MaxInterfacesPerBatch, 1)}
+        logging.info(
+            "SL-API interface limits: %i interfaces per batch.",
+            self.limits["max_interfaces"],
+        )
+        return self.limits
+
+    def load(self, timeout=10):
+        """Read every interface of the headend into the table, paging by
+        the router's batch size, and enable notifications for them.
+        Entries already updated by a newer notification are kept.
+        """
+        limits = self.get_limits(timeout)
+        getMsg = sl_interface_pb2.SLInterfaceGetMsg()
+        getMsg.EntriesCount = limits["max_interfaces"]
+        names = []
+        while True:
+            response = self.stub().SLInterfaceGet(getMsg, timeout)
+            if (
+                sl_common_types_pb2.SLErrorStatus.SL_SUCCESS
+                != response.ErrStatus.Status
+            ):
+                logging.error("Interface get failure 0x%x", response.ErrStatus.Status)
+                break
+            for entry in response.Entries:
+                self.__update_table(entry)
+                names.append(entry.SLIfInfo.Name)
+            if response.Eof or not response.Entries:
+                break
+            # Next page starts after the last interface received.
+            getMsg = sl_interface_pb2.SLInterfaceGetMsg()
+            getMsg.Key.Name = response.Entries[-1].SLIfInfo.Name
+            getMsg.EntriesCount = limits["max_interfaces"]
+            getMsg.GetNext = True
+        logging.info("Read %i headend interfaces.", len(names))
+        self.__enable(names, timeout)
+
+    def sync(self, interfaces, timeout=10):
+        """Report state changes of interfaces, a set of interface names,
+        enabling notifications for any not loaded.
+        """
+        self.watched = set(interfaces)
+        self.__enable(self.watched, timeout)
+
+    def __enable(self, interfaces, timeout):
+        enabled = set(interfaces) - self.enabled
+        if enabled:
+            self.enabled |= self.__notif_operation(
+                sl_common_types_pb2.SL_NOTIFOP_ENABLE, enabled, timeout
+            )
+
+    def __update_table(self, info):
+        """Take an SLInterfaceInfoMsg, returns the previous entry."""
+        interface = info.SLIfInfo.Name
+        previous = self.table.get(interface)
+        if previous is not None and 0 < info.SeqNum < previous[1]:
+            # Older than what we have, 0 for no sequence number.
+            return previous
+        if info.IfState == sl_interface_pb2.SL_IF_STATE_UP:
+            up = True
+        elif info.IfState == sl_interface_pb2.SL_IF_STATE_DOWN:
+            up = False
+        else:
+            up = None
+        self.table[interface] = (up, info.SeqNum)
+        return previous
+
+    def resolve(self, first_hop):
+        """Headend interface name of a path's first hop edge: the name
+        configured for its FromInterfaceIP, else its FromInterfaceName if
+        the headend has it, else the name last resolved for the IP.
+        "" if there is no name at all, leaving the nexthop interface unset.
+        """
+        address = first_hop.get("FromInterfaceIP")
+        name = self.names.get(address)
+        if name is not None:
+            return name
+        name = first_hop.get("FromInterfaceName")
+        if name in self.table:
+            if address is not None:
+                self.learned[address] = name
+            return name
+        learned = self.learned.get(address)
+        if learned is not None:
+            return learned
+        if (address, name) not in self.unresolved:
+            self.unresolved.add((address, name))
+            if name:
+                logging.warning(
+                    "Headend has no interface %s for %s, using it as is.",
+                    name,
+                    address,
+                )
+            else:
+                logging.warning(
+                    "No interface name for %s, leaving the nexthop interface unset.",
+                    address,
+                )
+        return name or ""
+
+    def resolve_paths(self, paths):
+        """Paths, a dict of pair -> path, with the first hop interface
+        names resolved.
+        """
+        resolved = {}
+        for pair, path in paths.items():
+            if path:
+                name = self.resolve(path[0])
+                if name != path[0].get("FromInterfaceName"):
+                    path = [dict(path[0], FromInterfaceName=name)] + path[1:]
+            resolved[pair] = path
+        return resolved
+
+    def __notif_operation(self, oper, interfaces, timeout):
+        """Returns the interfaces the operation succeeded for."""
+        limits = self.get_limits(timeout)
+        interfaces = sorted(interfaces)
+        succeeded = set()
+        for offset in range(0, len(interfaces), limits["max_interfaces"]):
+            batch = interfaces[offset : offset + limits["max_interfaces"]]
+            notifMsg = sl_interface_pb2.SLInterfaceNotifMsg()
+            notifMsg.Oper = oper
+            for interface in batch:
+                notifMsg.Entries.add().Name = interface
+            response = self.stub().SLInterfaceNotifOp(notifMsg, timeout)
+            summary = response.StatusSummary.Status
+            if sl_common_types_pb2.SLErrorStatus.SL_SUCCESS == summary:
+                succeeded.update(batch)
+                continue
+            if summary != sl_common_types_pb2.SLErrorStatus.SL_SOME_ERR:
+                logging.error("Interface notification operation failure 0x%x", summary)
+                continue
+            # Interfaces not listed in Results succeeded.
+            failed = set()
+            for result in response.Results:
+                failed.add(result.Key.Name)
+                logging.error(
+                    "Interface notification operation failure 0x%x for %s",
+                    result.ErrStatus.Status,
+                    result.Key.Name,
+                )
+            succeeded.update(set(batch) - failed)
+        return succeeded
+
+    def open_stream(self):
+        return self.stub().SLInterfaceGetNotifStream(
+            sl_interface_pb2.SLInterfaceGetNotifMsg()
+        )
+
+    def handle_notification(self, notif):
+        if notif.EventType == sl_interface_pb2.SL_INTERFACE_EVENT_TYPE_ERROR:
+            logging.error("Interface notification error 0x%x", notif.ErrStatus.Status)
+            return
+        if notif.EventType != sl_interface_pb2.SL_INTERFACE_EVENT_TYPE_INTERFACE_INFO:
+            return
+        interface = notif.Info.SLIfInfo.Name
+        previous = self.__update_table(notif.Info)
+        up = self.table[interface][0]
+        if interface not in self.watched or up is None:
+            return
+        # Interfaces with no known state count as up.
+        if (previous is None or previous[0] is not False) == up:
+            return
+        if up:
+            logging.info("Interface %s is up.", interface)
+        else:
+            logging.warning("Interface %s is down.", interface)
+        self.listener(interface, up)
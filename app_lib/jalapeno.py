@@ -3,22 +3,117 @@ from arango import ArangoClient
 
 
 class Jalapeno:
-    def __init__(self, netloc, username, password, db_name="jalapeno"):
+    # Query text is constant so ArangoDB can reuse it, only bind variables vary.
+    # Only the edge _id and the fields needed to derive the SL-API route are
+    # returned.
+    LEAST_UTILIZED_PATH_QUERY = """
+    FOR v, e IN OUTBOUND SHORTEST_PATH @src TO @dst @@graph
+        OPTIONS {weightAttribute: @weight}
+        FILTER e != null
+        RETURN {
+            _id: e._id,
+            ToInterfaceIP: e.ToInterfaceIP,
+            FromInterfaceName: e.FromInterfaceName,
+            FromInterfaceIP: e.FromInterfaceIP,
+            RemotePrefixSID: e.RemotePrefixSID,
+            Weight: e[@weight]
+        }
+    """
+    # Same traversal for many (src, dst) pairs in a single query.
+    LEAST_UTILIZED_PATHS_QUERY = """
+    FOR pair IN @pairs
+        LET path = (
+            FOR v, e IN OUTBOUND SHORTEST_PATH
+                CONCAT('LSNode/', pair[0]) TO CONCAT('LSNode/', pair[1]) @@graph
+                OPTIONS {weightAttribute: @weight}
+                FILTER e != null
+                RETURN {
+                    _id: e._id,
+                    ToInterfaceIP: e.ToInterfaceIP,
+                    FromInterfaceName: e.FromInterfaceName,
+                    FromInterfaceIP: e.FromInterfaceIP,
+                    RemotePrefixSID: e.RemotePrefixSID,
+                    Weight: e[@weight]
+                }
+        )
+        RETURN [pair[0], pair[1], path]
+    """
+    # Current weights of the edges of previously computed paths, null for
+    # edges that no longer exist.
+    PATH_WEIGHTS_QUERY = """
+    FOR edge_ids IN @paths
+        RETURN (
+            FOR edge_id IN edge_ids
+                LET e = DOCUMENT(edge_id)
+                RETURN e == null ? null : [e[@weight]]
+        )
+    """
+
+    def __init__(
+        self,
+        netloc,
+        username,
+        password,
+        db_name="jalapeno",
+        graph="LSv4_Topology",
+        weight_attribute="Percent_Util_Outbound",
+    ):
         self.client = ArangoClient(hosts=netloc)
         self.db = self.client.db(db_name, username=username, password=password)
+        self.graph = graph
+        self.weight_attribute = weight_attribute
 
     def get_least_utilized_path(self, src_ip, dst_ip):
         """Use the shortest path query on the anonymous LS_Topology graph
         to determine headend -> headend optimal path.
         """
-        query = """
-        FOR v, e IN OUTBOUND SHORTEST_PATH 'LSNode/%s' TO 'LSNode/%s' LSv4_Topology
-            OPTIONS {weightAttribute: 'Percent_Util_Outbound'}
-            FILTER e != null
-            RETURN e
-        """ % (
-            src_ip,
-            dst_ip,
+        cursor = self.db.aql.execute(
+            self.LEAST_UTILIZED_PATH_QUERY,
+            bind_vars={
+                "src": "LSNode/%s" % src_ip,
+                "dst": "LSNode/%s" % dst_ip,
+                "@graph": self.graph,
+                "weight": self.weight_attribute,
+            },
         )
-        cursor = self.db.aql.execute(query)
         return [edge for edge in cursor]
+
+    def get_least_utilized_paths(self, pairs):
+        """Determine the optimal path for many (src_ip, dst_ip) pairs
+        with a single query. Returns a dict of (src_ip, dst_ip) -> path.
+        """
+        pairs = list(dict.fromkeys(tuple(pair) for pair in pairs))
+        if not pairs:
+            return {}
+        # Whole result in one batch so round trips do not grow with pairs.
+        cursor = self.db.aql.execute(
+            self.LEAST_UTILIZED_PATHS_QUERY,
+            bind_vars={
+                "pairs": pairs,
+                "@graph": self.graph,
+                "weight": self.weight_attribute,
+            },
+            batch_size=len(pairs),
+        )
+        return {(src_ip, dst_ip): path for src_ip, dst_ip, path in cursor}
+
+    def get_path_weights(self, paths):
+        """Current edge weights of previously returned paths, given as a dict
+        of key -> path. Returns key -> list of weights, or None for paths
+        with edges no longer in the topology.
+        """
+        keys = list(paths)
+        if not keys:
+            return {}
+        cursor = self.db.aql.execute(
+            self.PATH_WEIGHTS_QUERY,
+            bind_vars={
+                "paths": [[edge["_id"] for edge in paths[key]] for key in keys],
+                "weight": self.weight_attribute,
+            },
+            batch_size=len(keys),
+        )
+        return {
+            key: None if None in weights else [weight[0] for weight in weights]
+            for key, weights in zip(keys, cursor)
+        }
@@ -0,0 +1,313 @@
+"""MPLS label block and ILM programming over SL-API.
+Used for binding SID style steering: prefixes are routed onto a binding
+label and the router's ILM entry for that label swaps it for the computed
+label stack, so one ILM update re-steers every prefix sharing the label.
+"""
+import ipaddress
+import logging
+
+from .proto import sl_common_types_pb2
+from .proto import sl_mpls_pb2
+from .proto import sl_mpls_pb2_grpc
+from .sl_api import OBJECT_OP_NAMES, REG_OP_NAMES
+
+
+class SLMplsWrapper:
+    """SL-API MPLS operations on the channel of an SLAPIWrapper.
+    Owns one label block of block_size labels from start_label.
+    """
+
+    def __init__(self, sl_api, start_label=24000, block_size=1000):
+        self.sl_api = sl_api
+        self.compression = sl_api.compression
+        self.start_label = start_label
+        self.block_size = block_size
+        self.registered = False
+        self.limits = None
+
+    def stub(self):
+        """Stub on the current channel, which is rebuilt on reconnection."""
+        return self.sl_api.service_stub(sl_mpls_pb2_grpc.SLMplsOperStub)
+
+    def register(self, timeout=10):
+        """Register for MPLS without EOF, like SLAPIWrapper.vrf_register."""
+        self.__registration(sl_common_types_pb2.SL_REGOP_REGISTER, timeout)
+        self.registered = True
+
+    def eof(self, timeout=10):
+        self.__registration(sl_common_types_pb2.SL_REGOP_EOF, timeout)
+
+    def cleanup(self, timeout=10):
+        if self.registered:
+            self.__registration(sl_common_types_pb2.SL_REGOP_UNREGISTER, timeout)
+            self.registered = False
+
+    def __registration(self, oper, timeout):
+        regMsg = sl_mpls_pb2.SLMplsRegMsg()
+        regMsg.Oper = oper
+        response = self.stub().SLMplsRegOp(regMsg, timeout)
+        if sl_common_types_pb2.SLErrorStatus.SL_SUCCESS == response.ErrStatus.Status:
+            logging.info(
+                "MPLS operation successful: %s",
+                REG_OP_NAMES[oper],
+            )
+        else:
+            logging.error(
+                "MPLS operation failure 0x%x: %s",
+                response.ErrStatus.Status,
+                REG_OP_NAMES[oper],
+            )
+
+    def get_limits(self, timeout=10):
+        """Query the router MPLS limits. Cached after first query."""
+        if self.limits is not None:
+            return self.limits
+        response = self.stub().SLMplsGet(sl_mpls_pb2.SLMplsGetMsg(), timeout)
+        if sl_common_types_pb2.SLErrorStatus.SL_SUCCESS != response.ErrStatus.Status:
+            raise RuntimeError(
+                "SL-API MPLS globals failure 0x%x" % response.ErrStatus.Status
+            )
+        self.limits = {
+            "min_start_label": response.MinStartLabel,
+            "max_labels_per_block": response.MaxLabelsPerBlock,
+            "max_ilms": max(response.MaxIlmPerIlmmsg, 1),
+            "max_paths": max(response.MaxPathsPerIlm, 1),
+        }
+        logging.info(
+            "SL-API MPLS limits: start label >= %i, %i labels per block, "
+            "%i ILMs per message, %i paths per ILM.",
+            self.limits["min_start_label"],
+            self.limits["max_labels_per_block"],
+            self.limits["max_ilms"],
+            self.limits["max_paths"],
+        )
+        return self.limits
+
+    def labels(self):
+        """Labels of the owned label block."""
+        return range(self.start_label, self.start_label + self.block_size)
+
+    def reserve_label_block(self, timeout=10):
+        """Reserve the label block, an already reserved block is fine."""
+        limits = self.get_limits(timeout)
+        if self.start_label < limits["min_start_label"]:
+            raise ValueError(
+                "MPLS start label %i below router minimum %i"
+                % (self.start_label, limits["min_start_label"])
+            )
+        if limits["max_labels_per_block"] and (
+            self.block_size > limits["max_labels_per_block"]
+        ):
+            raise ValueError(
+                "MPLS label block of %i labels exceeds router maximum %i"
+                % (self.block_size, limits["max_labels_per_block"])
+            )
+        return self.__label_block_operation(sl_common_types_pb2.SL_OBJOP_ADD, timeout)
+
+    def release_label_block(self, timeout=10):
+        return self.__label_block_operation(
+            sl_common_types_pb2.SL_OBJOP_DELETE, timeout
+        )
+
+    def __label_block_operation(self, oper, timeout):
+        blockMsg = sl_mpls_pb2.SLMplsLabelBlockMsg()
+        blockMsg.Oper = oper
+        block = blockMsg.MplsBlocks.add()
+        block.StartLabel = self.start_label
+        block.LabelBlockSize = self.block_size
+        response = self.stub().SLMplsLabelBlockOp(blockMsg, timeout)
+        status = response.StatusSummary.Status
+        if status == sl_common_types_pb2.SLErrorStatus.SL_SOME_ERR:
+            status = response.Results[0].ErrStatus.Status
+        if status in [
+            sl_common_types_pb2.SLErrorStatus.SL_SUCCESS,
+            sl_common_types_pb2.SLErrorStatus.SL_LABEL_BLK_EEXIST,
+        ]:
+            logging.info(
+                "MPLS label block %i+%i operation successful: %s",
+                self.start_label,
+                self.block_size,
+                OBJECT_OP_NAMES[oper],
+            )
+            return True
+        logging.error(
+            "MPLS label block %i+%i operation failure 0x%x: %s",
+            self.start_label,
+            self.block_size,
+            status,
+            OBJECT_OP_NAMES[oper],
+        )
+        return False
+
+    def ilms_add(self, ilms, timeout=10):
+        """Install ILM entries in as few SL-API messages as the router allows.
+        ilms is a dict of local label -> path dict with nexthop_ip,
+        nexthop_intf and label_stack. Returns label -> SL-API status code.
+        """
+        return self.__ilms_operation(sl_common_types_pb2.SL_OBJOP_ADD, ilms, timeout)
+
+    def ilms_update(self, ilms, timeout=10):
+        """Replace the paths of installed ILM entries, make-before-break."""
+        return self.__ilms_operation(sl_common_types_pb2.SL_OBJOP_UPDATE, ilms, timeout)
+
+    def ilms_remove(self, labels, timeout=10):
+        return self.__ilms_operation(
+            sl_common_types_pb2.SL_OBJOP_DELETE, dict.fromkeys(labels), timeout
+        )
+
+    def __ilms_operation(self, oper, ilms, timeout):
+        limits = self.get_limits(timeout)
+        labels = list(ilms)
+        results = {}
+        for offset in range(0, len(labels), limits["max_ilms"]):
+            batch = labels[offset : offset + limits["max_ilms"]]
+            ilmMsg = sl_mpls_pb2.SLMplsIlmMsg()
+            ilmMsg.Oper = oper
+            for label in batch:
+                ilm = ilmMsg.MplsIlms.add()
+                ilm.Key.LocalLabel = label
+                if oper != sl_common_types_pb2.SL_OBJOP_DELETE:
+                    ilm.Paths.extend([self.__build_path(ilms[label])])
+            response = self.stub().SLMplsIlmOp(
+                ilmMsg, timeout, compression=self.compression
+            )
+            results.update(self.__ilm_results(oper, batch, response))
+        return results
+
+    def __build_path(self, path):
+        """Swap the binding label for the label stack towards the nexthop."""
+        sl_path = sl_mpls_pb2.SLMplsPath()
+        nexthop_address = ipaddress.ip_address(path["nexthop_ip"])
+        if isinstance(nexthop_address, ipaddress.IPv4Address):
+            sl_path.NexthopAddress.V4Address = int(nexthop_address)
+        else:
+            sl_path.NexthopAddress.V6Address = nexthop_address.packed
+        if path["nexthop_intf"]:
+            sl_path.NexthopInterface.Name = path["nexthop_intf"]
+        sl_path.LoadMetric = path.get("load_metric", 3)
+        if path["label_stack"]:
+            sl_path.Action = sl_mpls_pb2.SL_LABEL_ACTION_SWAP
+            sl_path.LabelStack.extend(path["label_stack"])
+        else:
+            # Destination is the next hop itself.
+            sl_path.Action = sl_mpls_pb2.SL_LABEL_ACTION_POP_AND_FORWARD
+        return sl_path
+
+    def __ilm_results(self, oper, batch, response):
+        summary = response.StatusSummary.Status
+        results = dict.fromkeys(batch, summary)
+        if sl_common_types_pb2.SLErrorStatus.SL_SUCCESS == summary:
+            logging.info(
+                "ILM operation successful: %s (%i labels)",
+                OBJECT_OP_NAMES[oper],
+                len(batch),
+            )
+            return results
+        logging.error(
+            "ILM operation failure 0x%x: %s",
+            summary,
+            OBJECT_OP_NAMES[oper],
+        )
+        if summary == sl_common_types_pb2.SLErrorStatus.SL_SOME_ERR:
+            # Labels not listed in Results were programmed successfully.
+            results = dict.fromkeys(batch, sl_common_types_pb2.SLErrorStatus.SL_SUCCESS)
+            for result in response.Results:
+                results[result.Key.LocalLabel] = result.ErrStatus.Status
+                logging.debug(
+                    "Error code for label %i is 0x%x",
+                    result.Key.LocalLabel,
+                    result.ErrStatus.Status,
+                )
+        return results
+
+
+class BindingSids:
+    """One binding label per steering policy, e.g. a gateway pair.
+    Routes of all prefixes steered by a policy point at its binding label
+    through nexthop_ip/nexthop_intf, which must bring labelled packets back
+    to the headend for the ILM lookup (e.g. a loopback).
+    """
+
+    def __init__(self, mpls, nexthop_ip, nexthop_intf):
+        self.mpls = mpls
+        self.nexthop_ip = nexthop_ip
+        self.nexthop_intf = nexthop_intf
+        self.free_labels = list(reversed(mpls.labels()))
+        # Policy -> binding label
+        self.labels = {}
+        # Binding label -> (nexthop_ip, nexthop_intf, label_stack) installed
+        self.installed = {}
+        self.synced = False
+
+    def route_path(self, label):
+        """Route path keys steering onto a binding label."""
+        return {
+            "nexthop_ip": self.nexthop_ip,
+            "nexthop_intf": self.nexthop_intf,
+            "label_stack": [label],
+        }
+
+    def sync(self, policies, replay=False):
+        """Point every policy's binding label at its path in one bulk pass.
+        policies is a dict of policy -> path dict with nexthop_ip,
+        nexthop_intf and label_stack. Labels of policies no longer present
+        are withdrawn and reused. With replay every ILM is pushed as an
+        update, as after a re-registration. The first sync always replays,
+        so ILMs left by a previous run are overwritten instead of failing.
+        Returns policy -> binding label for every policy installed.
+        """
+        replay = replay or not self.synced
+        self.synced = True
+        added = {}
+        updated = {}
+        for policy, path in policies.items():
+            value = (
+                path["nexthop_ip"],
+                path["nexthop_intf"],
+                tuple(path["label_stack"]),
+            )
+            label = self.labels.get(policy)
+            if label is None:
+                if not self.free_labels:
+                    logging.error("MPLS label block exhausted, not binding %s.", policy)
+                    continue
+                label = self.labels[policy] = self.free_labels.pop()
+            if replay:
+                updated[label] = value
+            elif label not in self.installed:
+                added[label] = value
+            elif self.installed[label] != value:
+                updated[label] = value
+        removed = [policy for policy in self.labels if policy not in policies]
+        self.__apply(self.mpls.ilms_add, added)
+        self.__apply(self.mpls.ilms_update, updated)
+        if removed:
+            removed_labels = [self.labels[policy] for policy in removed]
+            results = self.mpls.ilms_remove(removed_labels)
+            for policy, label in zip(removed, removed_labels):
+                if results[label] == sl_common_types_pb2.SLErrorStatus.SL_SUCCESS:
+                    del self.labels[policy]
+                    self.installed.pop(label, None)
+                    self.free_labels.append(label)
+        return {
+            policy: label
+            for policy, label in self.labels.items()
+            if policy in policies and label in self.installed
+        }
+
+    def __apply(self, operation, ilms):
+        if not ilms:
+            return
+        results = operation(
+            {
+                label: {
+                    "nexthop_ip": value[0],
+                    "nexthop_intf": value[1],
+                    "label_stack": list(value[2]),
+                }
+                for label, value in ilms.items()
+            }
+        )
+        for label, value in ilms.items():
+            if results[label] == sl_common_types_pb2.SLErrorStatus.SL_SUCCESS:
+                self.installed[label] = value
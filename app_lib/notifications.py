@@ -0,0 +1,69 @@
+"""SL-API notification streams read in a background thread."""
+import logging
+import threading
+
+import grpc
+
+
+class SLNotificationStream:
+    """Base for SL-API services reporting events over a server stream.
+    Subclasses implement open_stream(), returning the streaming call, and
+    handle_notification(notif). start(listener) reads the stream in a
+    thread, reopening it with backoff if it breaks, until stop().
+    """
+
+    # Service name for log messages.
+    service = "SL-API"
+
+    def __init__(self, reconnect_backoff=1, max_reconnect_backoff=30):
+        self.reconnect_backoff = reconnect_backoff
+        self.max_reconnect_backoff = max_reconnect_backoff
+        self.listener = None
+        self.exit_event = threading.Event()
+        self.notif_call = None
+        self.notif_thread = None
+
+    def open_stream(self):
+        raise NotImplementedError
+
+    def handle_notification(self, notif):
+        raise NotImplementedError
+
+    def start(self, listener):
+        """Open the notification stream, reporting to listener."""
+        self.listener = listener
+        if self.notif_thread is not None:
+            return
+        self.notif_thread = threading.Thread(target=self.__notif_main, daemon=True)
+        self.notif_thread.start()
+
+    def stop(self, timeout=10):
+        """Cancel the notification stream and wait for its thread."""
+        self.exit_event.set()
+        if self.notif_call is not None:
+            self.notif_call.cancel()
+        if self.notif_thread is not None:
+            self.notif_thread.join(timeout)
+
+    def __notif_main(self):
+        backoff = self.reconnect_backoff
+        while not self.exit_event.is_set():
+            try:
+                self.notif_call = self.open_stream()
+                for notif in self.notif_call:
+                    backoff = self.reconnect_backoff
+                    try:
+                        self.handle_notification(notif)
+                    except Exception:
+                        logging.exception(
+                            "Failed to handle %s notification.", self.service
+                        )
+            except (grpc.RpcError, ValueError) as error:
+                # ValueError if the session closed the channel under us.
+                if self.exit_event.is_set():
+                    break
+                logging.error("%s notification stream failed: %s", self.service, error)
+            if self.exit_event.wait(backoff):
+                break
+            logging.info("Reopening %s notification stream.", self.service)
+            backoff = min(backoff * 2, self.max_reconnect_backoff)
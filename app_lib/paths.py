@@ -0,0 +1,127 @@
+"""Interned paths shared by every flow with the same gateway pair."""
+import collections
+
+Path = collections.namedtuple("Path", ["nexthop_ip", "nexthop_intf", "label_stack"])
+
+
+class PathTable:
+    """Current path per (source gateway, destination gateway) pair.
+    Paths are immutable and interned, equal paths are the same object no
+    matter how many pairs or flows use them. Subscribers, such as flows,
+    are registered per pair and handed out when the pair's path changes.
+    """
+
+    def __init__(self):
+        self.interned = {}
+        # Pair -> Path
+        self.paths = {}
+        # Pair -> [subscriber]
+        self.subscribers = {}
+
+    def subscribe(self, pair, subscriber):
+        self.subscribers.setdefault(pair, []).append(subscriber)
+
+    def pairs(self):
+        return list(self.subscribers)
+
+    def intern(self, nexthop_ip, nexthop_intf, label_stack):
+        path = Path(nexthop_ip, nexthop_intf, tuple(label_stack))
+        return self.interned.setdefault(path, path)
+
+    def update(self, paths, pairs=None):
+        """Replace the paths of all pairs, or only of pairs if given, with
+        paths, a dict of pair -> Path or None for no path. Returns the pairs
+        whose path changed.
+        """
+        changed = []
+        for pair in self.subscribers if pairs is None else pairs:
+            path = paths.get(pair)
+            if self.paths.get(pair) is not path:
+                changed.append(pair)
+                if path is None:
+                    del self.paths[pair]
+                else:
+                    self.paths[pair] = path
+        if pairs is not None:
+            return changed
+        # Forget paths no pair uses anymore.
+        in_use = set(self.paths.values())
+        self.interned = {path: path for path in self.interned if path in in_use}
+        return changed
+
+    def get(self, pair):
+        return self.paths.get(pair)
+
+    def fan_out(self, pairs):
+        """(subscriber, path) for every subscriber of the given pairs."""
+        for pair in pairs:
+            path = self.paths.get(pair)
+            for subscriber in self.subscribers.get(pair, ()):
+                yield subscriber, path
+
+
+class AlternatePaths:
+    """Recently computed paths of each gateway pair, the latest one per
+    first hop neighbor, to fall back on while a first hop neighbor or
+    interface is down without waiting for a recompute. Paths are as
+    returned by get_least_utilized_paths, at most max_paths are kept per
+    pair.
+    """
+
+    def __init__(self, max_paths=4):
+        self.max_paths = max_paths
+        # Pair -> {neighbor: path}, least recently computed first.
+        self.paths = {}
+        # First hop neighbors and interfaces currently down.
+        self.down_neighbors = set()
+        self.down_interfaces = set()
+
+    def record(self, paths):
+        """Take the paths of a cycle, a dict of pair -> path."""
+        for pair, path in paths.items():
+            if not path:
+                continue
+            alternates = self.paths.setdefault(pair, {})
+            neighbor = path[0]["ToInterfaceIP"]
+            alternates.pop(neighbor, None)
+            alternates[neighbor] = path
+            if len(alternates) > self.max_paths:
+                del alternates[next(iter(alternates))]
+        # Forget pairs no longer steered, and first hops no path uses.
+        for pair in list(self.paths):
+            if pair not in paths:
+                del self.paths[pair]
+        first_hops = self.first_hops()
+        self.down_neighbors.intersection_update(first_hops)
+        self.down_interfaces.intersection_update(first_hops.values())
+
+    def first_hops(self):
+        """Neighbor -> interface name of every first hop of a kept path."""
+        return {
+            neighbor: path[0].get("FromInterfaceName") or ""
+            for alternates in self.paths.values()
+            for neighbor, path in alternates.items()
+        }
+
+    def is_down(self, path):
+        return (
+            path[0]["ToInterfaceIP"] in self.down_neighbors
+            or path[0].get("FromInterfaceName") in self.down_interfaces
+        )
+
+    def avoid(self, paths):
+        """Replace paths through a down first hop by the latest alternate,
+        or no path if there is none.
+        """
+        if not self.down_neighbors and not self.down_interfaces:
+            return dict(paths)
+        return {
+            pair: self.alternate(pair) if path and self.is_down(path) else path
+            for pair, path in paths.items()
+        }
+
+    def alternate(self, pair):
+        for path in reversed(list(self.paths.get(pair, {}).values())):
+            if not self.is_down(path):
+                return path
+        return []
@@ -0,0 +1,191 @@
+"""Desired-state route reconciliation.
+Keeps the desired and last programmed route tables and pushes only the
+minimal set of changes between them.
+"""
+import asyncio
+import collections
+import logging
+
+from .proto import sl_common_types_pb2
+from .sl_api import route_key
+
+RouteKey = collections.namedtuple("RouteKey", ["vrf_name", "prefix", "prefix_len"])
+RouteValue = collections.namedtuple(
+    "RouteValue",
+    ["nexthop_ip", "nexthop_intf", "label_stack", "admin_distance", "load_metric"],
+)
+
+
+def route_id(route):
+    """RouteKey of a route dict."""
+    return RouteKey(route.get("vrf_name", "default"), *route_key(route))
+
+
+def route_entry(route):
+    """Split a route dict into its compact (RouteKey, RouteValue) form."""
+    return (
+        route_id(route),
+        RouteValue(
+            route["nexthop_ip"],
+            route["nexthop_intf"],
+            tuple(route.get("label_stack", ())),
+            route.get("admin_distance", 2),
+            route.get("load_metric", 3),
+        ),
+    )
+
+
+def route_dict(key, value=None):
+    """Route dict for SLAPIWrapper from its compact form."""
+    route = key._asdict()
+    if value is not None:
+        route.update(value._asdict())
+        route["label_stack"] = list(value.label_stack)
+    return route
+
+
+class RouteReconciler:
+    """Diffs desired routes against programmed routes and applies the changes.
+    programmer is anything with routes_add/routes_update/routes_remove,
+    such as SLAPIWrapper or SLRouteStream.
+    """
+
+    def __init__(self, programmer):
+        self.programmer = programmer
+        # RouteKey -> RouteValue
+        self.desired = {}
+        self.programmed = {}
+        # Keys whose desired and programmed state may differ, only these
+        # are compared by diff().
+        self.dirty = set()
+
+    def set_desired(self, routes):
+        """Replace the desired table with the given route dicts."""
+        self.desired = dict(route_entry(route) for route in routes)
+        self.dirty = set(self.desired) | set(self.programmed)
+
+    def update_desired(self, routes):
+        """Add or change the given route dicts in the desired table."""
+        for key, value in map(route_entry, routes):
+            self.desired[key] = value
+            self.dirty.add(key)
+
+    def remove_desired(self, routes):
+        """Drop the given route dicts from the desired table."""
+        for key in map(route_id, routes):
+            self.desired.pop(key, None)
+            self.dirty.add(key)
+
+    def load_programmed(self, routes):
+        """Replace the programmed table with routes read from the router."""
+        self.programmed = dict(route_entry(route) for route in routes)
+        self.dirty = set(self.desired) | set(self.programmed)
+
+    def diff(self):
+        """Minimal change sets as lists of keys: (added, updated, removed)."""
+        added = []
+        updated = []
+        removed = []
+        for key in self.dirty:
+            value = self.desired.get(key)
+            programmed_value = self.programmed.get(key)
+            if value is None:
+                if programmed_value is not None:
+                    removed.append(key)
+            elif programmed_value is None:
+                added.append(key)
+            elif programmed_value != value:
+                updated.append(key)
+        return added, updated, removed
+
+    def reconcile(self, replay=False):
+        """Push the difference to the router. Returns the number of changes.
+        With replay every desired route is pushed as an update, which the
+        router needs after a VRF re-registration to keep routes past EOF.
+        """
+        changes = self.__changes(replay)
+        for operation, keys, removed in changes:
+            for vrf_name, vrf_keys, routes in self.__batches(keys, removed):
+                results = getattr(self.programmer, operation)(routes, vrf_name)
+                self.__record(vrf_keys, results, removed)
+        return self.__finish(changes)
+
+    async def reconcile_async(self, replay=False):
+        """reconcile for a programmer with coroutine route operations,
+        such as AsyncSLAPIWrapper. VRFs are pushed concurrently.
+        """
+        changes = self.__changes(replay)
+        for operation, keys, removed in changes:
+            batches = self.__batches(keys, removed)
+            all_results = await asyncio.gather(
+                *(
+                    getattr(self.programmer, operation)(routes, vrf_name)
+                    for vrf_name, _, routes in batches
+                )
+            )
+            for (_, vrf_keys, _), results in zip(batches, all_results):
+                self.__record(vrf_keys, results, removed)
+        return self.__finish(changes)
+
+    def __changes(self, replay):
+        """Operations to run in order as (method name, keys, removed)."""
+        if replay:
+            # EOF purges whatever is not replayed, routes withdrawn in the
+            # meantime included, so only replayed routes count as programmed.
+            self.programmed = {}
+            self.dirty = set(self.desired)
+            added, updated, removed = [], list(self.desired), []
+        else:
+            added, updated, removed = self.diff()
+        if not (added or updated or removed):
+            logging.debug("%i routes unchanged, nothing to do.", len(self.desired))
+            return []
+        logging.info(
+            "Reconciling %i routes: %i new, %i changed, %i withdrawn.",
+            len(self.desired),
+            len(added),
+            len(updated),
+            len(removed),
+        )
+        # Updates swap paths in place, the prefixes are never withdrawn.
+        return [
+            ("routes_add", added, False),
+            ("routes_update", updated, False),
+            ("routes_remove", removed, True),
+        ]
+
+    def __batches(self, keys, removed):
+        """One bulk operation per VRF as (VRF name, keys, route dicts)."""
+        keys_by_vrf = {}
+        for key in keys:
+            keys_by_vrf.setdefault(key.vrf_name, []).append(key)
+        batches = []
+        for vrf_name, vrf_keys in keys_by_vrf.items():
+            if removed:
+                routes = [route_dict(key) for key in vrf_keys]
+            else:
+                routes = [route_dict(key, self.desired[key]) for key in vrf_keys]
+            batches.append((vrf_name, vrf_keys, routes))
+        return batches
+
+    def __record(self, keys, results, removed):
+        """Record what the router accepted. Failed routes keep their previous
+        programmed state and retry next time.
+        """
+        for key in keys:
+            status = results.get((key.prefix, key.prefix_len))
+            if status != sl_common_types_pb2.SLErrorStatus.SL_SUCCESS:
+                continue
+            if removed:
+                del self.programmed[key]
+            else:
+                self.programmed[key] = self.desired[key]
+
+    def __finish(self, changes):
+        # Failed routes stay dirty and are retried next time.
+        self.dirty = {
+            key
+            for key in self.dirty
+            if self.desired.get(key) != self.programmed.get(key)
+        }
+        return sum(len(keys) for _, keys, _ in changes)
@@ -0,0 +1,268 @@
+"""Long-lived SL-API route programming stream.
+Keeps a single SLRoutev4OpStream (and SLRoutev6OpStream once IPv6 routes are
+submitted) open and pipelines route messages over it, correlating responses
+as they arrive instead of waiting on each RPC.
+"""
+import collections
+import concurrent.futures
+import itertools
+import logging
+import threading
+import time
+
+import grpc
+
+from .proto import sl_common_types_pb2
+
+
+class SLRouteStream:
+    """Route programming over one bidirectional route stream per address family.
+    Messages are queued by submit() and sent by the stream threads with up to
+    max_in_flight unacknowledged at a time per stream. If a stream breaks it
+    is reopened and all its unacknowledged messages are resent.
+    Needs to be closed on exit.
+    """
+
+    def __init__(
+        self, sl_api, max_in_flight=32, reconnect_backoff=1, max_reconnect_backoff=30
+    ):
+        self.sl_api = sl_api
+        self.max_in_flight = max_in_flight
+        self.reconnect_backoff = reconnect_backoff
+        self.max_reconnect_backoff = max_reconnect_backoff
+        self.correlators = itertools.count(1)
+        # Correlator -> (oper, routes, message, future) for every queued message.
+        self.entries = {}
+        # Per address family: correlators waiting to be sent, and sent but
+        # not yet acknowledged.
+        self.outboxes = {}
+        self.in_flight = {}
+        self.generations = {}
+        self.calls = {}
+        self.stream_threads = {}
+        self.condition = threading.Condition()
+        self.closing = False
+
+    def submit(self, oper, routes, vrf_name="default", timeout=10):
+        """Queue a route operation, returns a list of futures.
+        Each future resolves to the per-route results of one route message.
+        """
+        return [future for _, future in self.__enqueue(oper, routes, vrf_name, timeout)]
+
+    def __enqueue(self, oper, routes, vrf_name, timeout):
+        """Queue a route operation, returns (correlator, future) pairs."""
+        messages = list(
+            self.sl_api.build_route_messages(oper, routes, vrf_name, timeout)
+        )
+        queued = []
+        with self.condition:
+            if self.closing:
+                raise RuntimeError("Route stream is closed.")
+            for address_family, batch, rtMsg in messages:
+                if address_family not in self.stream_threads:
+                    self.__start_stream(address_family)
+                correlator = next(self.correlators)
+                rtMsg.Correlator = correlator
+                future = concurrent.futures.Future()
+                self.entries[correlator] = (oper, batch, rtMsg, future)
+                self.outboxes[address_family].append(correlator)
+                queued.append((correlator, future))
+            self.condition.notify_all()
+        return queued
+
+    def routes_add(self, routes, vrf_name="default", timeout=10):
+        return self.__submit_wait(
+            sl_common_types_pb2.SL_OBJOP_ADD, routes, vrf_name, timeout
+        )
+
+    def routes_update(self, routes, vrf_name="default", timeout=10):
+        return self.__submit_wait(
+            sl_common_types_pb2.SL_OBJOP_UPDATE, routes, vrf_name, timeout
+        )
+
+    def routes_remove(self, routes, vrf_name="default", timeout=10):
+        return self.__submit_wait(
+            sl_common_types_pb2.SL_OBJOP_DELETE, routes, vrf_name, timeout
+        )
+
+    def __submit_wait(self, oper, routes, vrf_name, timeout):
+        """Blocking form of submit() matching the SLAPIWrapper interface.
+        Raises RuntimeError if a message is not answered within timeout
+        seconds of the previous one, e.g. while the stream cannot reopen.
+        The unanswered messages are then dropped, so they cannot land
+        after a newer operation on the same routes.
+        """
+        queued = self.__enqueue(oper, routes, vrf_name, timeout)
+        results = {}
+        for _, future in queued:
+            try:
+                results.update(future.result(timeout))
+            except concurrent.futures.TimeoutError:
+                self.__drop(correlator for correlator, _ in queued)
+                raise RuntimeError(
+                    "No route stream response in %s seconds." % timeout
+                ) from None
+        return results
+
+    def __drop(self, correlators):
+        """Forget messages not answered yet, whether waiting to be sent or
+        in flight, so they are never sent or resent. Responses to messages
+        already in flight are ignored.
+        """
+        with self.condition:
+            dropped = 0
+            for correlator in correlators:
+                entry = self.entries.pop(correlator, None)
+                if entry is None:
+                    continue
+                dropped += 1
+                for address_family, outbox in self.outboxes.items():
+                    if correlator in outbox:
+                        outbox.remove(correlator)
+                    self.in_flight[address_family].pop(correlator, None)
+                entry[3].set_exception(RuntimeError("Route message dropped."))
+            self.condition.notify_all()
+        if dropped:
+            logging.warning("Dropped %i unanswered route messages.", dropped)
+
+    def flush(self, timeout=None):
+        """Wait until every queued message has been acknowledged."""
+        with self.condition:
+            return self.condition.wait_for(lambda: not self.entries, timeout)
+
+    def close(self, timeout=10):
+        """Drain queued messages, then end the streams, within timeout
+        seconds in total.
+        """
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            self.closing = True
+            self.condition.notify_all()
+        for address_family, stream_thread in self.stream_threads.items():
+            stream_thread.join(max(deadline - time.monotonic(), 0))
+            call = self.calls.get(address_family)
+            if stream_thread.is_alive() and call is not None:
+                logging.warning(
+                    "IPv%i route stream did not drain in time, cancelling.",
+                    address_family,
+                )
+                call.cancel()
+        with self.condition:
+            for correlator in list(self.entries):
+                _, _, _, future = self.entries.pop(correlator)
+                future.set_exception(RuntimeError("Route stream closed."))
+            for address_family in self.outboxes:
+                self.outboxes[address_family].clear()
+                self.in_flight[address_family].clear()
+            self.condition.notify_all()
+
+    def __start_stream(self, address_family):
+        self.outboxes[address_family] = collections.deque()
+        self.in_flight[address_family] = collections.OrderedDict()
+        self.generations[address_family] = 0
+        stream_thread = threading.Thread(
+            target=self.__stream_main, args=(address_family,), daemon=True
+        )
+        self.stream_threads[address_family] = stream_thread
+        stream_thread.start()
+
+    def __pending(self, address_family):
+        return self.outboxes[address_family] or self.in_flight[address_family]
+
+    def __stream_main(self, address_family):
+        backoff = self.reconnect_backoff
+        while True:
+            with self.condition:
+                if self.closing and not self.__pending(address_family):
+                    break
+                generation = self.generations[address_family]
+            try:
+                # Fetched per attempt, the session may have a new channel.
+                open_stream = self.sl_api.route_rpc(address_family, "OpStream")
+                call = open_stream(
+                    self.__requests(address_family, generation),
+                    compression=self.sl_api.compression,
+                )
+                self.calls[address_family] = call
+                for response in call:
+                    backoff = self.reconnect_backoff
+                    self.__handle_response(address_family, response)
+                if self.closing:
+                    break
+                logging.warning(
+                    "SL-API IPv%i route stream ended by server.", address_family
+                )
+            except (grpc.RpcError, ValueError) as error:
+                # ValueError if the session closed the channel under us.
+                if self.closing and not self.__pending(address_family):
+                    break
+                logging.error(
+                    "SL-API IPv%i route stream broken: %s", address_family, error
+                )
+            self.__requeue_in_flight(address_family)
+            logging.info(
+                "Reopening SL-API IPv%i route stream in %s seconds.",
+                address_family,
+                backoff,
+            )
+            with self.condition:
+                # Closing skips the wait but still retries the remaining messages.
+                self.condition.wait_for(lambda: self.closing, backoff)
+            backoff = min(backoff * 2, self.max_reconnect_backoff)
+        logging.info("SL-API IPv%i route stream closed.", address_family)
+
+    def __requests(self, address_family, generation):
+        """Request iterator for one stream instance.
+        Returns once the stream has been superseded or everything is drained.
+        """
+        outbox = self.outboxes[address_family]
+        in_flight = self.in_flight[address_family]
+        while True:
+            with self.condition:
+                self.condition.wait_for(
+                    lambda: generation != self.generations[address_family]
+                    or (outbox and len(in_flight) < self.max_in_flight)
+                    or (self.closing and not self.__pending(address_family))
+                )
+                if generation != self.generations[address_family] or not outbox:
+                    return
+                correlator = outbox.popleft()
+                in_flight[correlator] = True
+                _, _, rtMsg, _ = self.entries[correlator]
+            yield rtMsg
+
+    def __handle_response(self, address_family, response):
+        with self.condition:
+            in_flight = self.in_flight[address_family]
+            if response.Correlator not in in_flight:
+                logging.debug(
+                    "Ignoring response for unknown correlator %i.", response.Correlator
+                )
+                return
+            del in_flight[response.Correlator]
+            oper, batch, _, future = self.entries.pop(response.Correlator)
+            self.condition.notify_all()
+        future.set_result(self.sl_api.route_results(oper, batch, response))
+
+    def __requeue_in_flight(self, address_family):
+        """Move unacknowledged messages back to the front of the outbox.
+        The previous stream's request iterator is retired by bumping generation.
+        """
+        with self.condition:
+            self.generations[address_family] += 1
+            in_flight = self.in_flight[address_family]
+            for correlator in in_flight:
+                oper, batch, rtMsg, future = self.entries[correlator]
+                if oper == sl_common_types_pb2.SL_OBJOP_ADD:
+                    # The router may have applied the ADD before the stream broke,
+                    # replaying it would fail with SL_ROUTE_EEXIST. UPDATE will not.
+                    rtMsg.Oper = sl_common_types_pb2.SL_OBJOP_UPDATE
+            self.outboxes[address_family].extendleft(reversed(in_flight))
+            if in_flight:
+                logging.info(
+                    "Resending %i unacknowledged IPv%i route messages.",
+                    len(in_flight),
+                    address_family,
+                )
+            in_flight.clear()
+            self.condition.notify_all()
@@ -0,0 +1,67 @@
+"""SL-API sessions to many headend routers from one process."""
+import concurrent.futures
+import logging
+import threading
+
+from .sl_api import SLAPIWrapper
+
+
+class RouterRegistry:
+    """One SLAPIWrapper per headend router, keyed by the gateway the router
+    is known as in srcGatewayIP. Each session has its own channel, watchdog
+    thread and VRF registration state. A session added with gateway None
+    serves every gateway without a session of its own.
+    Needs to be closed on exit.
+    """
+
+    def __init__(self, max_workers=32):
+        self.sessions = {}
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers)
+
+    def add(
+        self,
+        gateway,
+        netloc,
+        vrfs=None,
+        channel=None,
+        liveness=None,
+        unregister_on_exit=False,
+    ):
+        self.sessions[gateway] = SLAPIWrapper(
+            netloc,
+            threading.Event(),
+            vrfs=vrfs,
+            channel=channel,
+            liveness=liveness,
+            unregister_on_exit=unregister_on_exit,
+        )
+        logging.info("Added SL-API session to %s for %s.", netloc, gateway or "all")
+        return self.sessions[gateway]
+
+    def key(self, gateway):
+        """Key of the session owning gateway."""
+        if gateway in self.sessions:
+            return gateway
+        if None in self.sessions:
+            return None
+        raise KeyError("No SL-API session for headend %s" % gateway)
+
+    def session(self, gateway):
+        return self.sessions[self.key(gateway)]
+
+    def for_each(self, function, keys=None):
+        """Run function(key) for the given session keys (default all)
+        concurrently. Returns key -> result, raising the first error.
+        """
+        keys = list(self.sessions if keys is None else keys)
+        futures = {key: self.executor.submit(function, key) for key in keys}
+        return {key: future.result() for key, future in futures.items()}
+
+    def close(self, timeout=5):
+        """Close every session concurrently, within timeout seconds."""
+        list(
+            self.executor.map(
+                lambda session: session.close(timeout), self.sessions.values()
+            )
+        )
+        self.executor.shutdown()
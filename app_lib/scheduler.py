@@ -0,0 +1,56 @@
+"""Decides when the control loop should recompute paths."""
+import threading
+import time
+
+
+class RecomputeScheduler:
+    """Event driven recompute trigger.
+    Change sources call notify(), the control loop blocks in wait().
+    Notifications within debounce seconds of the first one are coalesced
+    into a single recompute, and recomputes are at least min_interval apart.
+    With poll_time set a recompute is also triggered poll_time seconds after
+    the last one, for when no change source is available.
+    """
+
+    def __init__(self, debounce=0.5, min_interval=1, poll_time=None):
+        self.debounce = debounce
+        self.min_interval = min_interval
+        self.poll_time = poll_time
+        self.condition = threading.Condition()
+        self.stopped = False
+        # Always compute once on startup.
+        self.first_change = time.monotonic() - debounce
+        self.last_run = float("-inf")
+
+    def notify(self):
+        """Signal that something relevant to path computation changed."""
+        with self.condition:
+            if self.first_change is None:
+                self.first_change = time.monotonic()
+                self.condition.notify_all()
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+
+    def wait(self):
+        """Block until a recompute is due. Returns False once stopped."""
+        with self.condition:
+            while not self.stopped:
+                now = time.monotonic()
+                if self.first_change is not None:
+                    due = max(
+                        self.first_change + self.debounce,
+                        self.last_run + self.min_interval,
+                    )
+                elif self.poll_time is not None:
+                    due = self.last_run + self.poll_time
+                else:
+                    due = None
+                if due is not None and due <= now:
+                    self.first_change = None
+                    self.last_run = now
+                    return True
+                self.condition.wait(None if due is None else due - now)
+            return False
@@ -2,10 +2,14 @@
 Attempts to provide some structure around SL-API usage.
 Implicitly starts a watchdog thread which needs to be cleaned up.
 """
+import collections
+import functools
 import ipaddress
 import os
+import queue
 import sys
 import threading
+import time
 import logging
 
 import grpc
@@ -16,15 +20,373 @@ from .proto import sl_common_types_pb2
 from .proto import sl_version_pb2
 from .proto import sl_route_ipv4_pb2_grpc
 from .proto import sl_route_ipv4_pb2
+from .proto import sl_route_ipv6_pb2_grpc
+from .proto import sl_route_ipv6_pb2
 from .proto import sl_route_common_pb2
 
+# The IPv4 and IPv6 route services mirror each other, RPCs are named
+# rpc_prefix + operation e.g. SLRoutev6Op.
+RouteAfi = collections.namedtuple(
+    "RouteAfi", ["stub", "route", "msg", "get_msg", "rpc_prefix"]
+)
+ROUTE_AFIS = {
+    4: RouteAfi(
+        sl_route_ipv4_pb2_grpc.SLRoutev4OperStub,
+        sl_route_ipv4_pb2.SLRoutev4,
+        sl_route_ipv4_pb2.SLRoutev4Msg,
+        sl_route_ipv4_pb2.SLRoutev4GetMsg,
+        "SLRoutev4",
+    ),
+    6: RouteAfi(
+        sl_route_ipv6_pb2_grpc.SLRoutev6OperStub,
+        sl_route_ipv6_pb2.SLRoutev6,
+        sl_route_ipv6_pb2.SLRoutev6Msg,
+        sl_route_ipv6_pb2.SLRoutev6GetMsg,
+        "SLRoutev6",
+    ),
+}
+# Operation names for logging.
+OBJECT_OP_NAMES = {
+    value: name for name, value in sl_common_types_pb2.SLObjectOp.items()
+}
+REG_OP_NAMES = {value: name for name, value in sl_common_types_pb2.SLRegOp.items()}
+
+
+# Channel settings -> gRPC channel arguments.
+CHANNEL_ARGUMENTS = {
+    "keepalive_time_ms": "grpc.keepalive_time_ms",
+    "keepalive_timeout_ms": "grpc.keepalive_timeout_ms",
+    "keepalive_permit_without_calls": "grpc.keepalive_permit_without_calls",
+    "max_pings_without_data": "grpc.http2.max_pings_without_data",
+    "max_send_message_length": "grpc.max_send_message_length",
+    "max_receive_message_length": "grpc.max_receive_message_length",
+    # HTTP/2 flow control windows are sized by BDP probing, on by default.
+    "bdp_probe": "grpc.http2.bdp_probe",
+    "max_frame_size": "grpc.http2.max_frame_size",
+}
+
+
+def create_channel(netloc, settings=None, aio=False):
+    """gRPC channel to netloc with settings from the SL-API "channel" config,
+    keys of CHANNEL_ARGUMENTS plus "options" for raw channel arguments and
+    "tls" to use a TLS channel. aio creates a grpc.aio channel.
+    """
+    settings = settings or {}
+    options = [
+        (argument, int(settings[key]))
+        for key, argument in CHANNEL_ARGUMENTS.items()
+        if key in settings
+    ]
+    options.extend(settings.get("options", {}).items())
+    grpc_module = grpc.aio if aio else grpc
+    tls = settings.get("tls")
+    if not tls:
+        return grpc_module.insecure_channel(netloc, options=options)
+    if "tls_server_name" in tls:
+        options.append(("grpc.ssl_target_name_override", tls["tls_server_name"]))
+    credentials = grpc.ssl_channel_credentials(
+        root_certificates=read_file(tls.get("root_certificates")),
+        private_key=read_file(tls.get("private_key")),
+        certificate_chain=read_file(tls.get("certificate_chain")),
+    )
+    return grpc_module.secure_channel(netloc, credentials, options=options)
+
+
+def read_file(filename):
+    if filename is None:
+        return None
+    with open(filename, "rb") as file_fd:
+        return file_fd.read()
+
+
+def route_compression(settings=None):
+    """Compression for bulk route and ILM messages, "gzip" or none."""
+    compression = (settings or {}).get("compression")
+    if compression is None:
+        return grpc.Compression.NoCompression
+    if compression == "gzip":
+        return grpc.Compression.Gzip
+    raise ValueError("Unknown SL-API compression %s" % compression)
+
+
+def route_key(route):
+    """Normalized (prefix, prefix_len) identifying a route dict."""
+    address = ipaddress.ip_address(route["prefix"])
+    return (str(address), route.get("prefix_len", address.max_prefixlen))
+
+
+def route_address_family(route):
+    return ipaddress.ip_address(route["prefix"]).version
+
+
+def vrf_reg_message(oper, vrf_name, settings):
+    """SLVrfRegMsg for one VRF with its vrf_settings."""
+    vrfMsg = sl_route_common_pb2.SLVrfRegMsg()
+    vrfObj = vrfMsg.VrfRegMsgs.add()
+    vrfObj.VrfName = vrf_name
+    vrfObj.AdminDistance = settings["admin_distance"]
+    vrfObj.VrfPurgeIntervalSeconds = settings["purge_interval"]
+    vrfMsg.Oper = oper
+    return vrfMsg
+
+
+def log_vrf_result(oper, vrf_name, address_family, response):
+    if sl_common_types_pb2.SLErrorStatus.SL_SUCCESS == response.StatusSummary.Status:
+        logging.info(
+            "VRF %s IPv%i operation successful: %s",
+            vrf_name,
+            address_family,
+            REG_OP_NAMES[oper],
+        )
+    else:
+        logging.error(
+            "VRF %s IPv%i operation failure 0x%x: %s",
+            vrf_name,
+            address_family,
+            response.StatusSummary.Status,
+            REG_OP_NAMES[oper],
+        )
+
+
+def route_limits(address_family, route_globals, global_globals):
+    """Routes per message and paths per route from the globals responses."""
+    max_routes = 1
+    max_paths = 1
+    if sl_common_types_pb2.SLErrorStatus.SL_SUCCESS == route_globals.ErrStatus.Status:
+        max_routes = max(route_globals.MaxRoutePerRoutemsg, 1)
+    else:
+        logging.error(
+            "SL-API route globals failure 0x%x, sending one route per message.",
+            route_globals.ErrStatus.Status,
+        )
+    if sl_common_types_pb2.SLErrorStatus.SL_SUCCESS == global_globals.ErrStatus.Status:
+        max_paths = max(global_globals.MaxPathsPerEntry, 1)
+    else:
+        logging.error(
+            "SL-API globals failure 0x%x, sending one path per route.",
+            global_globals.ErrStatus.Status,
+        )
+    logging.info(
+        "SL-API IPv%i route limits: %i routes per message, %i paths per route.",
+        address_family,
+        max_routes,
+        max_paths,
+    )
+    return {"max_routes": max_routes, "max_paths": max_paths}
+
+
+def group_routes(routes, vrf_name):
+    """Routes may carry their own VRF, each message is scoped to one VRF and
+    address family. Returns (VRF name, address family) -> routes.
+    """
+    routes_by_vrf = {}
+    for route in routes:
+        routes_by_vrf.setdefault(
+            (route.get("vrf_name", vrf_name), route_address_family(route)), []
+        ).append(route)
+    return routes_by_vrf
+
+
+def route_messages(oper, vrf_name, address_family, routes, limits, admin_distance):
+    """Pack routes of one VRF and address family into route messages.
+    Yields (routes in message, message).
+    """
+    afi = ROUTE_AFIS[address_family]
+    for offset in range(0, len(routes), limits["max_routes"]):
+        batch = routes[offset : offset + limits["max_routes"]]
+        rtMsg = afi.msg()
+        rtMsg.VrfName = vrf_name
+        rtMsg.Oper = oper
+        for route in batch:
+            build_route(
+                afi,
+                route,
+                oper,
+                limits["max_paths"],
+                admin_distance,
+                rtMsg.Routes.add(),
+            )
+        yield batch, rtMsg
+
+
+def build_route(afi, route, oper, max_paths, admin_distance, sl_route=None):
+    """Fill sl_route, by default a new SLRoutev4/SLRoutev6, from a route dict.
+    A route may define "paths" as a list of path dicts for ECMP,
+    otherwise its own nexthop keys describe the single path.
+    """
+    if sl_route is None:
+        sl_route = afi.route()
+    address = ipaddress.ip_address(route["prefix"])
+    if address.version == 4:
+        sl_route.Prefix = int(address)
+    else:
+        sl_route.Prefix = address.packed
+    sl_route.PrefixLen = route.get("prefix_len", address.max_prefixlen)
+    sl_route.RouteCommon.AdminDistance = route.get("admin_distance", admin_distance)
+    if oper == sl_common_types_pb2.SL_OBJOP_DELETE:
+        return sl_route
+    paths = route.get("paths", [route])
+    if len(paths) > max_paths:
+        logging.warning(
+            "Route %s/%d has %i paths, router supports %i. Truncating.",
+            route["prefix"],
+            sl_route.PrefixLen,
+            len(paths),
+            max_paths,
+        )
+        paths = paths[:max_paths]
+    for path in paths:
+        sl_route.PathList.add().MergeFrom(build_path(path))
+    return sl_route
+
+
+def build_path(path):
+    """SLRoutePath for a path dict. Shared by all routes with the same path,
+    copy it into the route and never modify it.
+    """
+    return path_prototype(
+        path["nexthop_ip"],
+        path["nexthop_intf"],
+        path.get("load_metric", 3),
+        tuple(path.get("label_stack", ())),
+    )
+
+
+@functools.lru_cache(maxsize=4096)
+def path_prototype(nexthop_ip, nexthop_intf, load_metric, label_stack):
+    sl_path = sl_route_common_pb2.SLRoutePath()
+    nexthop_address = ipaddress.ip_address(nexthop_ip)
+    if isinstance(nexthop_address, ipaddress.IPv4Address):
+        sl_path.NexthopAddress.V4Address = int(nexthop_address)
+    else:
+        sl_path.NexthopAddress.V6Address = nexthop_address.packed
+    if nexthop_intf:
+        sl_path.NexthopInterface.Name = nexthop_intf
+    sl_path.LoadMetric = load_metric
+    sl_path.LabelStack.extend(label_stack)
+    return sl_path
+
+
+def route_results(oper, batch, response):
+    """Map a route message response back to per-route status codes."""
+    summary = response.StatusSummary.Status
+    results = {route_key(route): summary for route in batch}
+    if sl_common_types_pb2.SLErrorStatus.SL_SUCCESS == summary:
+        logging.info(
+            "Route operation successful: %s (%i routes)",
+            OBJECT_OP_NAMES[oper],
+            len(batch),
+        )
+        return results
+    logging.error(
+        "Route operation failure 0x%x: %s",
+        summary,
+        OBJECT_OP_NAMES[oper],
+    )
+    if summary == sl_common_types_pb2.SLErrorStatus.SL_SOME_ERR:
+        # Routes not listed in Results were programmed successfully.
+        results = dict.fromkeys(results, sl_common_types_pb2.SLErrorStatus.SL_SUCCESS)
+        for result in response.Results:
+            key = (str(ipaddress.ip_address(result.Prefix)), result.PrefixLen)
+            results[key] = result.ErrStatus.Status
+            logging.debug(
+                "Error code for %s/%d is 0x%x",
+                key[0],
+                key[1],
+                result.ErrStatus.Status,
+            )
+    return results
+
+
+def route_from_message(sl_route, vrf_name):
+    """Route dict as taken by routes_add from a SLRoutev4/SLRoutev6."""
+    route = {
+        "vrf_name": vrf_name,
+        "prefix": str(ipaddress.ip_address(sl_route.Prefix)),
+        "prefix_len": sl_route.PrefixLen,
+        "admin_distance": sl_route.RouteCommon.AdminDistance,
+    }
+    paths = [path_from_message(sl_path) for sl_path in sl_route.PathList]
+    if paths:
+        route.update(paths[0])
+    if len(paths) > 1:
+        route["paths"] = paths
+    return route
+
+
+def path_from_message(sl_path):
+    if sl_path.NexthopAddress.WhichOneof("Address") == "V6Address":
+        nexthop_ip = ipaddress.ip_address(sl_path.NexthopAddress.V6Address)
+    else:
+        nexthop_ip = ipaddress.ip_address(sl_path.NexthopAddress.V4Address)
+    return {
+        "nexthop_ip": str(nexthop_ip),
+        "nexthop_intf": sl_path.NexthopInterface.Name,
+        "load_metric": sl_path.LoadMetric,
+        "label_stack": list(sl_path.LabelStack),
+    }
+
 
 class SLAPIWrapper:
-    def __init__(self, netloc, exit_thread_event):
-        self.channel = grpc.insecure_channel(netloc)
+    def __init__(
+        self,
+        netloc,
+        exit_thread_event,
+        vrfs=None,
+        channel=None,
+        liveness=None,
+        unregister_on_exit=False,
+    ):
+        # channel holds the channel settings taken by create_channel.
+        self.netloc = netloc
+        self.channel_settings = channel
+        self.channel = create_channel(netloc, channel)
+        self.compression = route_compression(channel)
         self.stub = sl_global_pb2_grpc.SLGlobalStub(self.channel)
         self.exit_event = exit_thread_event
+        # VRF name -> {"admin_distance": int, "purge_interval": int}
+        self.vrfs = vrfs or {}
+        # (VRF name, address family) registered with the router.
+        self.registered_vrfs = []
+        # Unregistering deletes everything programmed. By default the
+        # registrations are left for the next run to reconcile before EOF,
+        # or for the purge timer.
+        self.unregister_on_exit = unregister_on_exit
+        # Address family -> route limits
+        self.route_limits = {}
+        # Address family -> stub, (address family, operation) -> RPC
+        self.route_stubs = {}
+        self.route_rpcs = {}
+        # Stub class -> stub of the other SL-API services.
+        self.service_stubs = {}
+        self.notif_call = None
+        # Deadline of close(), None until closing.
+        self.closing = None
+        # The session is declared dead after missed_heartbeats heartbeat
+        # intervals without a message, heartbeat_interval seconds or, if
+        # not set, as measured. It is then re-established with backoff.
+        liveness = liveness or {}
+        self.missed_heartbeats = liveness.get("missed_heartbeats", 3)
+        self.heartbeat_interval = liveness.get("heartbeat_interval")
+        self.reconnect_backoff = liveness.get("reconnect_backoff", 1)
+        self.max_reconnect_backoff = liveness.get("max_reconnect_backoff", 30)
+        self.heartbeat_intervals = collections.deque(maxlen=16)
+        self.last_heartbeat = None
+        self.last_message = None
+        # Set while the session is up, cleared until it is re-established.
+        self.alive = threading.Event()
+        self.down_since = None
+        self.recovery_times = []
+        # Replays on recovery, next to the watchdog reading heartbeats.
+        self.recovery_thread = None
+        # Called after re-establishing the session and registering the
+        # VRFs again, to replay desired state before VRF EOF.
+        self.reconnect_listeners = []
         self.watchdog_thread = self.start_notification_watchdog()
+        self.liveness_thread = threading.Thread(
+            target=self.__liveness_main, daemon=True
+        )
+        self.liveness_thread.start()
 
     def start_notification_watchdog(self):
         """Setup and start watchdog thread."""
@@ -38,19 +400,165 @@ class SLAPIWrapper:
 
     def __watchdog_main(self, stub, ready_event, exit_event):
         """Thread which receives various SL-API messages.
-        Needs to be joined on exit. exit_event indicates should exit.
-        Currently only exits on SL-API heartbeat.
-        Need to poll or select or something on iteration somehow.
+        Re-establishes the session if the notification stream fails or
+        heartbeats stop, and keeps trying to establish it in the background
+        if the router cannot be reached at first. Exits when the router ends
+        the session, or at once when close() cancels the notification
+        stream, unregistering the VRFs if unregister_on_exit is set.
+        """
+        backoff = self.reconnect_backoff
+        while self.__notification_stream(ready_event):
+            self.alive.clear()
+            self.__join_recovery()
+            if self.last_message is None:
+                # Never established, nothing to recover yet.
+                if not ready_event.is_set():
+                    logging.warning(
+                        "SL-API session to %s not established, retrying.", self.netloc
+                    )
+                    ready_event.set()
+            elif self.down_since is None:
+                # Down since the last sign of life, detection time included.
+                self.down_since = self.last_message
+                backoff = self.reconnect_backoff
+            logging.info("Re-establishing SL-API session in %ss.", backoff)
+            if exit_event.wait(backoff):
+                break
+            backoff = min(backoff * 2, self.max_reconnect_backoff)
+            self.__rebuild_channel()
+        # Never leave the constructor waiting.
+        ready_event.set()
+        self.alive.clear()
+        self.__join_recovery()
+        if self.unregister_on_exit:
+            if self.closing is None:
+                self.cleanup()
+            else:
+                self.cleanup(max(self.closing - time.monotonic(), 0))
+        exit_event.set()
+
+    def __notification_stream(self, ready_event):
+        """Read one SLGlobalInitNotif stream until it ends.
+        Returns True if the session should be re-established.
         """
         init_msg = sl_global_pb2.SLInitMsg()
         init_msg.MajorVer = sl_version_pb2.SL_MAJOR_VERSION
         init_msg.MinorVer = sl_version_pb2.SL_MINOR_VERSION
         init_msg.SubVer = sl_version_pb2.SL_SUB_VERSION
         timeout = 365 * 24 * 60 * 60
-        for response in stub.SLGlobalInitNotif(init_msg, timeout):
-            if exit_event.is_set():
-                logging.warning("Exit event is set, exiting.")
+        self.notif_call = self.stub.SLGlobalInitNotif(init_msg, timeout)
+        self.last_heartbeat = None
+        try:
+            if not self.__watch(self.notif_call, ready_event):
+                return False
+            logging.error("SL-API notification stream ended.")
+        except grpc.RpcError as error:
+            if self.exit_event.is_set():
+                logging.info("SL-API notification stream cancelled.")
+                return False
+            logging.error("SL-API notification stream failed: %s", error)
+        return not self.exit_event.is_set()
+
+    def __rebuild_channel(self):
+        """New channel and stubs, so nothing of the failed session is reused.
+        The old channel is closed only once no new call can pick it up.
+        """
+        old_channel = self.channel
+        self.channel = create_channel(self.netloc, self.channel_settings)
+        self.stub = sl_global_pb2_grpc.SLGlobalStub(self.channel)
+        self.route_stubs = {}
+        self.route_rpcs = {}
+        self.service_stubs = {}
+        # The router may have changed, e.g. after an RP switchover.
+        self.route_limits = {}
+        old_channel.close()
+
+    def __start_recovery(self, notif_call):
+        self.recovery_thread = threading.Thread(
+            target=self.__recovery_main, args=(notif_call,), daemon=True
+        )
+        self.recovery_thread.start()
+
+    def __join_recovery(self):
+        """Wait for a replay broken by the session failing again."""
+        if self.recovery_thread is not None:
+            self.recovery_thread.join()
+            self.recovery_thread = None
+
+    def __recovery_main(self, notif_call):
+        """Replay while the watchdog keeps reading heartbeats, so a long
+        replay does not look like a dead session. If the replay fails the
+        session is re-established again.
+        """
+        try:
+            self.__recover()
+        except Exception:
+            if self.exit_event.is_set():
+                return
+            # No EOF was sent, the routes stay until the next attempt.
+            logging.exception("SL-API recovery failed.")
+            notif_call.cancel()
+
+    def __recover(self):
+        """Register the VRFs again and have the listeners replay desired
+        state, then EOF, reporting the time since the session went down.
+        Any listener failure aborts before EOF, which would purge whatever
+        was not replayed.
+        """
+        logging.warning("SL-API session re-established, replaying state.")
+        for vrf_name, address_family in self.registered_vrfs:
+            self.__vrf_operation(
+                sl_common_types_pb2.SL_REGOP_REGISTER, vrf_name, address_family
+            )
+        for listener in self.reconnect_listeners:
+            listener()
+        for vrf_name, address_family in self.registered_vrfs:
+            self.__vrf_operation(
+                sl_common_types_pb2.SL_REGOP_EOF, vrf_name, address_family
+            )
+        recovery_time = time.monotonic() - self.down_since
+        self.recovery_times.append(recovery_time)
+        self.down_since = None
+        logging.warning(
+            "SL-API session to %s recovered in %.3fs.", self.netloc, recovery_time
+        )
+
+    def expected_heartbeat_interval(self):
+        """Configured or measured (median) heartbeat interval, None if unknown."""
+        if self.heartbeat_interval is not None:
+            return self.heartbeat_interval
+        if not self.heartbeat_intervals:
+            return None
+        return sorted(self.heartbeat_intervals)[len(self.heartbeat_intervals) // 2]
+
+    def __liveness_main(self):
+        """Cancel the notification stream once heartbeats stop arriving, so
+        the watchdog re-establishes the session.
+        """
+        while True:
+            interval = self.expected_heartbeat_interval()
+            if self.exit_event.wait(1 if interval is None else interval / 2):
                 break
+            if interval is None or not self.alive.is_set():
+                continue
+            silence = time.monotonic() - self.last_message
+            if silence > self.missed_heartbeats * interval:
+                logging.error(
+                    "No SL-API message for %.1fs, %i heartbeats of %.1fs missed. "
+                    "Session is dead.",
+                    silence,
+                    self.missed_heartbeats,
+                    interval,
+                )
+                self.alive.clear()
+                self.notif_call.cancel()
+
+    def __watch(self, notif_call, ready_event):
+        for response in notif_call:
+            self.last_message = time.monotonic()
+            if self.exit_event.is_set():
+                logging.warning("Exit event is set, exiting.")
+                return False
             if response.EventType == sl_global_pb2.SL_GLOBAL_EVENT_TYPE_VERSION:
                 if response.ErrStatus.Status in [
                     sl_common_types_pb2.SLErrorStatus.SL_SUCCESS,
@@ -67,65 +575,143 @@ class SLAPIWrapper:
                         )
                     )
                     logging.info("SL-API watchdog started.")
+                    self.last_message = time.monotonic()
+                    self.alive.set()
+                    if self.down_since is not None:
+                        self.__start_recovery(notif_call)
                     ready_event.set()
                 else:
                     logging.error(
                         "SL-API watchdog failure: 0x%x", response.ErrStatus.Status
                     )
-                    break
+                    return False
             elif response.EventType == sl_global_pb2.SL_GLOBAL_EVENT_TYPE_HEARTBEAT:
                 logging.debug("Received SL-API heartbeat.")
+                if self.last_heartbeat is not None:
+                    self.heartbeat_intervals.append(
+                        self.last_message - self.last_heartbeat
+                    )
+                self.last_heartbeat = self.last_message
             elif response.EventType == sl_global_pb2.SL_GLOBAL_EVENT_TYPE_ERROR:
                 if (
                     sl_common_types_pb2.SLErrorStatus.SL_NOTIF_TERM
                     == response.ErrStatus.Status
                 ):
                     logging.warning("Received SL-API notice to terminate.")
-                    break
+                    return False
                 else:
-                    logging.error("Error not handled:", response)
+                    logging.error("Error not handled: %s", response)
             else:
                 logging.error(
                     "SL-API initialized with unrecognized response %d",
                     response.EventType,
                 )
-                break
-        self.cleanup()
-        exit_event.set()
+                return False
+        return True
 
-    def cleanup(self):
-        stub = self.__vrf_stub()
-        self.__vrf_operation(stub, sl_common_types_pb2.SL_REGOP_UNREGISTER)
+    def close(self, timeout=5):
+        """Cancel the notification stream and wait for the watchdog, which
+        unregisters the VRFs if unregister_on_exit is set, all within
+        timeout seconds, then close the channel. Does not wait for the next
+        heartbeat.
+        """
+        self.closing = time.monotonic() + timeout
+        self.exit_event.set()
+        if self.notif_call is not None:
+            self.notif_call.cancel()
+        self.watchdog_thread.join(timeout)
+        if self.watchdog_thread.is_alive():
+            logging.warning("SL-API watchdog did not exit in %ss.", timeout)
+        self.channel.close()
+
+    def cleanup(self, timeout=10):
+        """Unregister the VRFs, within timeout seconds in total."""
+        deadline = time.monotonic() + timeout
+        for vrf_name, address_family in self.registered_vrfs or [("default", 4)]:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                logging.warning("SL-API cleanup deadline passed, not unregistering.")
+                break
+            try:
+                self.__vrf_operation(
+                    sl_common_types_pb2.SL_REGOP_UNREGISTER,
+                    vrf_name,
+                    address_family,
+                    remaining,
+                )
+            except grpc.RpcError as error:
+                logging.error("SL-API cleanup failed: %s", error)
+                break
 
     def vrf_cleanup(self):
-        stub = self.__vrf_stub()
-        self.__vrf_operation(stub, sl_common_types_pb2.SL_REGOP_REGISTER)
-        self.__vrf_operation(stub, sl_common_types_pb2.SL_REGOP_EOF)
+        self.__vrf_operation(sl_common_types_pb2.SL_REGOP_REGISTER)
+        self.__vrf_operation(sl_common_types_pb2.SL_REGOP_EOF)
+
+    def vrf_register(self, vrf_name="default", address_family=4):
+        """Register the VRF without EOF, so installed routes can be read back
+        and reconciled before the router purges stale routes on vrf_eof().
+        """
+        self.__vrf_operation(
+            sl_common_types_pb2.SL_REGOP_REGISTER, vrf_name, address_family
+        )
+        if (vrf_name, address_family) not in self.registered_vrfs:
+            self.registered_vrfs.append((vrf_name, address_family))
 
-    def __vrf_stub(self):
-        return sl_route_ipv4_pb2_grpc.SLRoutev4OperStub(self.channel)
+    def vrf_eof(self, vrf_name="default", address_family=4):
+        self.__vrf_operation(sl_common_types_pb2.SL_REGOP_EOF, vrf_name, address_family)
 
-    def __vrf_operation(
+    def vrf_settings(self, vrf_name):
+        """Admin distance and stale route purge interval for the VRF."""
+        settings = {"admin_distance": 2, "purge_interval": 500}
+        settings.update(self.vrfs.get(vrf_name, {}))
+        return settings
+
+    def __vrf_operation(self, oper, vrf_name="default", address_family=4, timeout=10):
+        vrfMsg = vrf_reg_message(oper, vrf_name, self.vrf_settings(vrf_name))
+        response = self.route_rpc(address_family, "VrfRegOp")(vrfMsg, timeout)
+        log_vrf_result(oper, vrf_name, address_family, response)
+
+    def get_route_limits(self, address_family=4, timeout=10):
+        """Query the router for how many routes fit in one route message
+        and how many paths fit in one route. Cached after first query.
+        """
+        if address_family in self.route_limits:
+            return self.route_limits[address_family]
+        route_globals = self.route_rpc(address_family, "GlobalsGet")(
+            sl_route_common_pb2.SLRouteGlobalsGetMsg(), timeout
+        )
+        global_globals = self.stub.SLGlobalsGet(
+            sl_global_pb2.SLGlobalsGetMsg(), timeout
+        )
+        self.route_limits[address_family] = route_limits(
+            address_family, route_globals, global_globals
+        )
+        return self.route_limits[address_family]
+
+    def route_add(
         self,
-        stub,
-        oper,
         vrf_name="default",
+        prefix="172.31.101.67",
+        prefix_len=32,
         admin_distance=2,
-        purge_interval=500,
+        nexthop_ip="172.31.101.48",
+        nexthop_intf="Bundle-Ether3",
+        load_metric=3,
+        label_stack=[16005, 16006],
         timeout=10,
     ):
-        vrfMsg = sl_route_common_pb2.SLVrfRegMsg()
-        vrfList = []
-        vrfObj = sl_route_common_pb2.SLVrfReg()
-        vrfObj.VrfName = vrf_name
-        vrfObj.AdminDistance = admin_distance
-        vrfObj.VrfPurgeIntervalSeconds = purge_interval
-        vrfList.append(vrfObj)
-        vrfMsg.VrfRegMsgs.extend(vrfList)
-        vrfMsg.Oper = oper
-        response = stub.SLRoutev4VrfRegOp(vrfMsg, timeout)
+        route = {
+            "prefix": prefix,
+            "prefix_len": prefix_len,
+            "admin_distance": admin_distance,
+            "nexthop_ip": nexthop_ip,
+            "nexthop_intf": nexthop_intf,
+            "load_metric": load_metric,
+            "label_stack": label_stack,
+        }
+        return self.routes_add([route], vrf_name, timeout)
 
-    def route_add(
+    def route_update(
         self,
         vrf_name="default",
         prefix="172.31.101.67",
@@ -137,56 +723,19 @@ class SLAPIWrapper:
         label_stack=[16005, 16006],
         timeout=10,
     ):
-        oper = sl_common_types_pb2.SL_OBJOP_ADD
-        stub = self.__route_stub()
-        routeList = []
-        rtMsg = sl_route_ipv4_pb2.SLRoutev4Msg()
-        rtMsg.VrfName = vrf_name
-        route = sl_route_ipv4_pb2.SLRoutev4()
-        route.Prefix = int(ipaddress.ip_address(prefix))
-        route.PrefixLen = prefix_len
-        route.RouteCommon.AdminDistance = admin_distance
-        paths = []
-        path = sl_route_common_pb2.SLRoutePath()
-        nexthop_address = ipaddress.ip_address(nexthop_ip)
-        if isinstance(nexthop_address, ipaddress.IPv4Address):
-            path.NexthopAddress.V4Address = int(nexthop_address)
-        else:
-            path.NexthopAddress.V6Address = nexthop_address.packed
-        path.NexthopInterface.Name = nexthop_intf
-        path.LoadMetric = load_metric
-        path.LabelStack.extend(label_stack)
-        paths.append(path)
-        route.PathList.extend(paths)
-        routeList.append(route)
-        rtMsg.Routes.extend(routeList)
-        rtMsg.Oper = oper
-        response = stub.SLRoutev4Op(rtMsg, timeout)
-        if (
-            sl_common_types_pb2.SLErrorStatus.SL_SUCCESS
-            == response.StatusSummary.Status
-        ):
-            logging.info(
-                "Route operation successful: %s",
-                str(list(sl_common_types_pb2.SLObjectOp.keys())[oper]),
-            )
-        else:
-            logging.error(
-                "Route operation failure 0x%x: %s",
-                response.StatusSummary.Status,
-                str(list(sl_common_types_pb2.SLObjectOp.keys())[oper]),
-            )
-            if (
-                response.StatusSummary.Status
-                == sl_common_types_pb2.SLErrorStatus.SL_SOME_ERR
-            ):
-                for result in response.Results:
-                    logging.debug(
-                        "Error code for %s/%d is 0x%x",
-                        str(ipaddress.ip_address(result.Prefix)),
-                        result.PrefixLen,
-                        result.ErrStatus.Status,
-                    )
+        """Replace the paths of an installed route in a single operation,
+        the prefix is never withdrawn in between.
+        """
+        route = {
+            "prefix": prefix,
+            "prefix_len": prefix_len,
+            "admin_distance": admin_distance,
+            "nexthop_ip": nexthop_ip,
+            "nexthop_intf": nexthop_intf,
+            "load_metric": load_metric,
+            "label_stack": label_stack,
+        }
+        return self.routes_update([route], vrf_name, timeout)
 
     def route_remove(
         self,
@@ -200,44 +749,131 @@ class SLAPIWrapper:
         label_stack=[16005, 16006],
         timeout=10,
     ):
-        oper = sl_common_types_pb2.SL_OBJOP_DELETE
-        stub = self.__route_stub()
-        routeList = []
-        rtMsg = sl_route_ipv4_pb2.SLRoutev4Msg()
-        rtMsg.VrfName = vrf_name
-        route = sl_route_ipv4_pb2.SLRoutev4()
-        route.Prefix = int(ipaddress.ip_address(prefix))
-        route.PrefixLen = prefix_len
-        route.RouteCommon.AdminDistance = admin_distance
-        routeList.append(route)
-        rtMsg.Routes.extend(routeList)
-        rtMsg.Oper = oper  # Desired ADD, UPDATE, DELETE operation
-        response = stub.SLRoutev4Op(rtMsg, timeout)
-        if (
-            sl_common_types_pb2.SLErrorStatus.SL_SUCCESS
-            == response.StatusSummary.Status
+        route = {
+            "prefix": prefix,
+            "prefix_len": prefix_len,
+            "admin_distance": admin_distance,
+        }
+        return self.routes_remove([route], vrf_name, timeout)
+
+    def routes_add(self, routes, vrf_name="default", timeout=10):
+        """Add many routes in as few SL-API messages as the router allows.
+        routes is a list of dicts taking the same keys as route_add.
+        Returns a dict of (prefix, prefix_len) -> SL-API status code.
+        """
+        return self.__routes_operation(
+            sl_common_types_pb2.SL_OBJOP_ADD, routes, vrf_name, timeout
+        )
+
+    def routes_update(self, routes, vrf_name="default", timeout=10):
+        """Replace the paths of many installed routes, make-before-break."""
+        return self.__routes_operation(
+            sl_common_types_pb2.SL_OBJOP_UPDATE, routes, vrf_name, timeout
+        )
+
+    def routes_remove(self, routes, vrf_name="default", timeout=10):
+        """Remove many routes in as few SL-API messages as the router allows.
+        Only prefix, prefix_len and admin_distance are used from each route.
+        """
+        return self.__routes_operation(
+            sl_common_types_pb2.SL_OBJOP_DELETE, routes, vrf_name, timeout
+        )
+
+    def __routes_operation(self, oper, routes, vrf_name, timeout):
+        results = {}
+        for address_family, batch, rtMsg in self.build_route_messages(
+            oper, routes, vrf_name, timeout
         ):
-            logging.info(
-                "Route operation successful: %s",
-                str(list(sl_common_types_pb2.SLObjectOp.keys())[oper]),
-            )
-        else:
-            logging.error(
-                "Route operation failure 0x%x: %s",
-                response.StatusSummary.Status,
-                str(list(sl_common_types_pb2.SLObjectOp.keys())[oper]),
+            response = self.route_rpc(address_family, "Op")(
+                rtMsg, timeout, compression=self.compression
             )
+            results.update(self.route_results(oper, batch, response))
+        return results
+
+    def build_route_messages(self, oper, routes, vrf_name="default", timeout=10):
+        """Pack routes into SLRoutev4Msg/SLRoutev6Msg messages within the
+        router limits. Yields (address family, routes in message, message).
+        """
+        for (route_vrf, address_family), vrf_routes in group_routes(
+            routes, vrf_name
+        ).items():
+            limits = self.get_route_limits(address_family, timeout)
+            admin_distance = self.vrf_settings(route_vrf)["admin_distance"]
+            for batch, rtMsg in route_messages(
+                oper, route_vrf, address_family, vrf_routes, limits, admin_distance
+            ):
+                yield address_family, batch, rtMsg
+
+    def route_results(self, oper, batch, response):
+        return route_results(oper, batch, response)
+
+    def routes_get(self, vrf_name="default", address_family=4, timeout=60):
+        """Read all routes installed in the VRF, paging with GetNext over a
+        single SLRoutev4GetStream or SLRoutev6GetStream.
+        Returns route dicts as taken by routes_add.
+        """
+        afi = ROUTE_AFIS[address_family]
+        limits = self.get_route_limits(address_family)
+        requests = queue.Queue()
+        getMsg = afi.get_msg()
+        getMsg.VrfName = vrf_name
+        getMsg.EntriesCount = limits["max_routes"]
+        requests.put(getMsg)
+        routes = []
+        responses = self.route_rpc(address_family, "GetStream")(
+            iter(requests.get, None), timeout
+        )
+        for response in responses:
             if (
-                response.StatusSummary.Status
-                == sl_common_types_pb2.SLErrorStatus.SL_SOME_ERR
+                sl_common_types_pb2.SLErrorStatus.SL_SUCCESS
+                != response.ErrStatus.Status
             ):
-                for result in response.Results:
-                    logging.debug(
-                        "Error code for %s/%d is 0x%x",
-                        str(ipaddress.ip_address(result.Prefix)),
-                        result.PrefixLen,
-                        result.ErrStatus.Status,
-                    )
+                logging.error(
+                    "Route get failure 0x%x for VRF %s",
+                    response.ErrStatus.Status,
+                    vrf_name,
+                )
+                break
+            routes.extend(
+                route_from_message(entry, vrf_name) for entry in response.Entries
+            )
+            if response.Eof or not response.Entries:
+                break
+            # Next page starts after the last route received.
+            getMsg = afi.get_msg()
+            getMsg.VrfName = vrf_name
+            getMsg.Prefix = response.Entries[-1].Prefix
+            getMsg.PrefixLen = response.Entries[-1].PrefixLen
+            getMsg.EntriesCount = limits["max_routes"]
+            getMsg.GetNext = True
+            requests.put(getMsg)
+        requests.put(None)
+        responses.cancel()
+        logging.info(
+            "Read %i installed IPv%i routes in VRF %s.",
+            len(routes),
+            address_family,
+            vrf_name,
+        )
+        return routes
 
-    def __route_stub(self):
-        return sl_route_ipv4_pb2_grpc.SLRoutev4OperStub(self.channel)
+    def service_stub(self, stub_class):
+        """Stub of another SL-API service, made once per channel."""
+        stub = self.service_stubs.get(stub_class)
+        if stub is None:
+            stub = self.service_stubs[stub_class] = stub_class(self.channel)
+        return stub
+
+    def route_rpc(self, address_family, operation):
+        """Route service RPC by operation e.g. "Op" for SLRoutev4Op.
+        Stubs and their RPCs are made once per channel and reused.
+        """
+        rpc = self.route_rpcs.get((address_family, operation))
+        if rpc is None:
+            afi = ROUTE_AFIS[address_family]
+            stub = self.route_stubs.get(address_family)
+            if stub is None:
+                stub = self.route_stubs[address_family] = afi.stub(self.channel)
+            rpc = getattr(stub, afi.rpc_prefix + operation)
+            self.route_rpcs[(address_family, operation)] = rpc
+        return rpc
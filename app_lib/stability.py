@@ -0,0 +1,156 @@
+"""Path stability policy between path computation and route programming.
+Keeps each gateway pair on its current path unless a new path is clearly
+better, has been held long enough and the pair is not flapping.
+"""
+import logging
+import math
+import numbers
+import time
+
+
+def path_cost(weights):
+    """Sum of edge weights, non-numeric weights count as 1 like SHORTEST_PATH."""
+    return sum(
+        (
+            float(weight)
+            if isinstance(weight, numbers.Number) and not isinstance(weight, bool)
+            else 1.0
+        )
+        for weight in weights
+    )
+
+
+class PathStabilityPolicy:
+    """Hysteresis and flap dampening for least utilized paths.
+    A pair moves to a new path only when its cost is at least
+    improvement_threshold (a fraction) below the current cost of the held
+    path, and the held path is at least hold_time seconds old.
+    Each switch adds flap_penalty to the pair's penalty, which halves every
+    half_life seconds. Above suppress_threshold the pair stays on its path
+    until the penalty decays below reuse_threshold.
+    A held path which no longer exists is always replaced.
+    """
+
+    def __init__(
+        self,
+        improvement_threshold=0.1,
+        hold_time=30,
+        half_life=60,
+        flap_penalty=1000,
+        suppress_threshold=2000,
+        reuse_threshold=750,
+    ):
+        self.improvement_threshold = improvement_threshold
+        self.hold_time = hold_time
+        self.half_life = half_life
+        self.flap_penalty = flap_penalty
+        self.suppress_threshold = suppress_threshold
+        self.reuse_threshold = reuse_threshold
+        # Pair -> (path, time it was selected)
+        self.held = {}
+        # Pair -> (penalty, time it was last updated)
+        self.penalties = {}
+        self.suppressed = set()
+
+    def contested(self, paths):
+        """Held paths the freshly computed paths would replace, as a dict of
+        pair -> held path to be re-costed with get_path_weights.
+        """
+        return {
+            pair: self.held[pair][0]
+            for pair, path in paths.items()
+            if path
+            and pair in self.held
+            and self.__edge_ids(path) != self.__edge_ids(self.held[pair][0])
+        }
+
+    def apply(self, paths, held_weights):
+        """Filter freshly computed paths, a dict of pair -> path as returned
+        by get_least_utilized_paths, given the current weights of the
+        contested held paths. Returns the paths to program.
+        """
+        now = time.monotonic()
+        selected = {}
+        for pair, path in paths.items():
+            if not path:
+                # Nothing to hold on to, the route is withdrawn.
+                self.held.pop(pair, None)
+                selected[pair] = path
+                continue
+            if pair not in self.held:
+                self.held[pair] = (path, now)
+                selected[pair] = path
+                continue
+            held_path, since = self.held[pair]
+            if pair not in held_weights:
+                # Same path, keep the fresh weights.
+                self.held[pair] = (path, since)
+                selected[pair] = path
+                continue
+            if self.__switch(pair, path, held_weights.get(pair), since, now):
+                self.held[pair] = (path, now)
+                self.__add_penalty(pair, now)
+                selected[pair] = path
+            else:
+                selected[pair] = held_path
+        # Forget pairs no longer steered.
+        for pair in list(self.held):
+            if pair not in paths:
+                del self.held[pair]
+        for pair in list(self.penalties):
+            if pair not in paths:
+                del self.penalties[pair]
+        self.suppressed.intersection_update(paths)
+        return selected
+
+    def __switch(self, pair, path, held_weights, since, now):
+        if held_weights is None:
+            logging.info("Held path of %s to %s is gone, switching.", *pair)
+            return True
+        held_cost = path_cost(held_weights)
+        new_cost = path_cost(edge.get("Weight") for edge in path)
+        if new_cost > held_cost * (1 - self.improvement_threshold):
+            logging.debug(
+                "Keeping path of %s to %s, cost %s vs %s not enough of a gain.",
+                pair[0],
+                pair[1],
+                new_cost,
+                held_cost,
+            )
+            return False
+        if now - since < self.hold_time:
+            logging.debug("Keeping path of %s to %s, hold time not expired.", *pair)
+            return False
+        if self.__is_suppressed(pair, now):
+            logging.info("Path of %s to %s is flapping, suppressing switch.", *pair)
+            return False
+        logging.info(
+            "Switching path of %s to %s, cost %s to %s.",
+            pair[0],
+            pair[1],
+            held_cost,
+            new_cost,
+        )
+        return True
+
+    def __penalty(self, pair, now):
+        penalty, updated = self.penalties.get(pair, (0.0, now))
+        return penalty * math.pow(0.5, (now - updated) / self.half_life)
+
+    def __add_penalty(self, pair, now):
+        penalty = self.__penalty(pair, now) + self.flap_penalty
+        self.penalties[pair] = (penalty, now)
+        if penalty >= self.suppress_threshold:
+            self.suppressed.add(pair)
+
+    def __is_suppressed(self, pair, now):
+        if pair not in self.suppressed:
+            return False
+        if self.__penalty(pair, now) < self.reuse_threshold:
+            self.suppressed.discard(pair)
+            del self.penalties[pair]
+            return False
+        return True
+
+    def __edge_ids(self, path):
+        return [edge["_id"] for edge in path]
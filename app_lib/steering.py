@@ -0,0 +1,514 @@
+"""Steers many source prefixes onto their least utilized paths."""
+import asyncio
+import ipaddress
+import logging
+import threading
+import time
+
+from .paths import AlternatePaths, PathTable
+from .reconciler import RouteReconciler
+
+
+def path_hops(path):
+    """Nexthop and label stack of what Jalapeño returns for a path."""
+    return {
+        "nexthop_ip": path[0]["ToInterfaceIP"],
+        "nexthop_intf": path[0].get("FromInterfaceName") or "",
+        "label_stack": [int(e["RemotePrefixSID"]) for e in path[1:]],
+    }
+
+
+def steered_route(flow, hops, admin_distance=2):
+    """SL-API route steering a flow's source prefix onto hops."""
+    address = ipaddress.ip_address(flow["srcIP"])
+    route = {
+        "vrf_name": flow.get("vrfName", "default"),
+        "admin_distance": admin_distance,
+        "prefix": str(address),
+        "prefix_len": flow.get("srcPrefixLen", address.max_prefixlen),
+    }
+    route.update(hops)
+    return route
+
+
+class SteeringEngine:
+    """Computes paths for a table of flows and programs only what changed.
+    Each flow is a dict of srcIP, srcPrefixLen, srcGatewayIP, dstGatewayIP
+    and vrfName as found in config.json.
+    With binding_sids (a BindingSids) each gateway pair gets a binding label
+    and its flows are routed onto that label, so a path change is a single
+    ILM update instead of one route update per flow.
+    Paths are computed once per gateway pair and only the flows of pairs
+    whose path changed are rebuilt, so a cycle scales with gateway pairs.
+    With stability (a PathStabilityPolicy) new paths are only taken when
+    the policy allows, instead of on every change in least utilized path.
+    With route_stream (an SLRouteStream on sl_api) routes are pipelined
+    over a route stream instead of one RPC per bulk message.
+    With bfd (an SLBfdWrapper) the first hop neighbors of the paths are
+    monitored, and with interfaces (an SLInterfaceWrapper) their local
+    interfaces, which are also resolved against the headend's interfaces.
+    The flows leaving through a first hop which goes down are moved onto a
+    cached alternate path, or withdrawn, at once.
+    Once registered, the desired state is replayed whenever the SL-API
+    session is re-established.
+    """
+
+    def __init__(
+        self,
+        sl_api,
+        flows,
+        binding_sids=None,
+        stability=None,
+        bfd=None,
+        interfaces=None,
+        route_stream=None,
+    ):
+        self.sl_api = sl_api
+        self.flows = flows
+        self.binding_sids = binding_sids
+        self.stability = stability
+        self.bfd = bfd
+        self.interfaces = interfaces
+        self.route_stream = route_stream
+        self.reconciler = RouteReconciler(route_stream or sl_api)
+        self.path_table = PathTable()
+        self.alternates = AlternatePaths()
+        # Paths of the last cycle, and the paths programmed for them
+        # avoiding down first hops.
+        self.computed = {}
+        self.programmed = {}
+        # First hop neighbor / interface -> pairs with a computed or
+        # programmed path through it.
+        self.neighbor_pairs = {}
+        self.interface_pairs = {}
+        # Cycles and neighbor events program from different threads.
+        self.lock = threading.RLock()
+        for flow in flows:
+            self.path_table.subscribe(
+                (flow["srcGatewayIP"], flow["dstGatewayIP"]), flow
+            )
+
+    def vrf_address_families(self):
+        """(VRF name, address family) pairs the flows are steered in."""
+        return list(
+            dict.fromkeys(
+                (
+                    flow.get("vrfName", "default"),
+                    ipaddress.ip_address(flow["srcIP"]).version,
+                )
+                for flow in self.flows
+            )
+        )
+
+    def register(self):
+        """Register the VRFs (and MPLS for binding SIDs, BFD, interfaces)
+        without EOF.
+        """
+        if self.binding_sids is not None:
+            self.binding_sids.mpls.register()
+            self.binding_sids.mpls.reserve_label_block()
+        if self.bfd is not None:
+            self.bfd.register()
+            self.bfd.start(self.neighbor_state)
+        if self.interfaces is not None:
+            self.interfaces.register()
+            self.interfaces.start(self.interface_state)
+            self.interfaces.load()
+        for vrf_name, address_family in self.vrf_address_families():
+            self.sl_api.vrf_register(vrf_name, address_family)
+        if self.recover not in self.sl_api.reconnect_listeners:
+            self.sl_api.reconnect_listeners.append(self.recover)
+
+    def recover(self):
+        """Replay the desired state onto a re-established SL-API session,
+        called by the session after registering the VRFs again.
+        """
+        with self.lock:
+            if self.binding_sids is not None:
+                mpls = self.binding_sids.mpls
+                mpls.limits = None
+                mpls.register()
+                mpls.reserve_label_block()
+            if self.bfd is not None:
+                # Sessions went with the old registration, the new ones
+                # report their neighbors down again if they are.
+                self.bfd.reset()
+                self.alternates.down_neighbors.clear()
+                self.bfd.register()
+            if self.interfaces is not None:
+                self.interfaces.reset()
+                self.interfaces.register()
+                self.interfaces.load()
+            self.program(self.computed, replay=True)
+            if self.binding_sids is not None:
+                self.binding_sids.mpls.eof()
+            if self.bfd is not None:
+                self.bfd.eof()
+
+    def eof(self):
+        """Signal the desired state is programmed, purging stale routes."""
+        for vrf_name, address_family in self.vrf_address_families():
+            self.sl_api.vrf_eof(vrf_name, address_family)
+        if self.binding_sids is not None:
+            self.binding_sids.mpls.eof()
+        if self.bfd is not None:
+            self.bfd.eof()
+
+    def cleanup(self, timeout=10):
+        """Stop the streams within timeout seconds in total. ILMs, BFD
+        sessions and interface notifications stay registered like the VRFs,
+        unless the session unregisters on exit, so a restart reconciles them
+        before EOF.
+        """
+        deadline = time.monotonic() + timeout
+
+        def remaining():
+            return max(deadline - time.monotonic(), 0)
+
+        unregister = self.sl_api.unregister_on_exit
+        if self.route_stream is not None:
+            self.route_stream.close(remaining())
+        if self.interfaces is not None:
+            if unregister:
+                self.interfaces.cleanup(remaining())
+            else:
+                self.interfaces.stop(remaining())
+        if self.bfd is not None:
+            if unregister:
+                self.bfd.cleanup(remaining())
+            else:
+                self.bfd.stop(remaining())
+        if self.binding_sids is not None and unregister:
+            self.binding_sids.mpls.cleanup(remaining())
+
+    def load_installed(self):
+        """Index the routes already installed on the router, so the next
+        cycle only sends corrections instead of reprogramming everything.
+        """
+        installed = []
+        for vrf_name, address_family in self.vrf_address_families():
+            installed.extend(self.sl_api.routes_get(vrf_name, address_family))
+        self.reconciler.load_programmed(installed)
+
+    async def load_installed_async(self):
+        """load_installed for AsyncSLAPIWrapper, VRFs are read concurrently."""
+        installed = await asyncio.gather(
+            *(
+                self.sl_api.routes_get(vrf_name, address_family)
+                for vrf_name, address_family in self.vrf_address_families()
+            )
+        )
+        self.reconciler.load_programmed(
+            [route for routes in installed for route in routes]
+        )
+
+    def gateway_pairs(self):
+        return self.path_table.pairs()
+
+    def run_cycle(self, path_source, replay=False):
+        """Compute the path of every gateway pair once and push the routes
+        of the flows whose path changed to SL-API in one bulk pass.
+        With replay every route is pushed, as after a VRF re-registration.
+        """
+        paths = path_source.get_least_utilized_paths(self.gateway_pairs())
+        self.program(self.select_paths(paths, path_source), replay)
+
+    def contested_paths(self, paths):
+        """Held paths whose current weights select_paths needs."""
+        if self.stability is None:
+            return {}
+        return self.stability.contested(paths)
+
+    def select_paths(self, paths, path_source, held_weights=None):
+        """Paths to program out of freshly computed paths, querying the
+        weights of the contested paths unless held_weights are given.
+        """
+        if self.stability is None:
+            return paths
+        if held_weights is None:
+            held_weights = path_source.get_path_weights(self.contested_paths(paths))
+        return self.stability.apply(paths, held_weights)
+
+    def program(self, paths, replay=False):
+        with self.lock:
+            self.update_paths(paths, replay)
+            if not self.sl_api.alive.is_set():
+                # Replayed once the session is re-established.
+                logging.warning("SL-API session down, not programming.")
+                return
+            self.reconciler.reconcile(replay)
+            first_hops = self.alternates.first_hops()
+            if self.bfd is not None:
+                self.bfd.sync(first_hops)
+            if self.interfaces is not None:
+                self.interfaces.sync(name for name in first_hops.values() if name)
+
+    def neighbor_state(self, neighbor, up):
+        """Move flows off a first hop neighbor which went down, or back
+        onto their computed paths once it is up, without a recompute.
+        """
+        with self.lock:
+            if up:
+                self.alternates.down_neighbors.discard(neighbor)
+            else:
+                self.alternates.down_neighbors.add(neighbor)
+            self.__resteer(
+                "neighbor %s" % neighbor, up, self.neighbor_pairs.get(neighbor, ())
+            )
+
+    def interface_state(self, interface, up):
+        """As neighbor_state, for a first hop interface of the headend."""
+        with self.lock:
+            if up:
+                self.alternates.down_interfaces.discard(interface)
+            else:
+                self.alternates.down_interfaces.add(interface)
+            self.__resteer(
+                "interface %s" % interface,
+                up,
+                self.interface_pairs.get(interface, ()),
+            )
+
+    def __resteer(self, first_hop, up, pairs):
+        """Reprogram only the given pairs from their computed paths."""
+        start = time.monotonic()
+        pairs = list(pairs)
+        programmed = self.alternates.avoid(
+            {pair: self.computed.get(pair) for pair in pairs}
+        )
+        self.programmed.update(programmed)
+        self.__index_first_hops(programmed)
+        self.__update_routes(programmed, pairs=pairs)
+        self.reconciler.reconcile()
+        logging.info(
+            "Re-steered %i paths for %s %s in %.1f ms.",
+            len(pairs),
+            first_hop,
+            "up" if up else "down",
+            (time.monotonic() - start) * 1000,
+        )
+
+    async def run_cycle_async(self, path_source, replay=False):
+        """run_cycle for AsyncJalapeno and AsyncSLAPIWrapper.
+        Binding SIDs and BFD are not supported here.
+        """
+        paths = await path_source.get_least_utilized_paths(self.gateway_pairs())
+        if self.stability is not None:
+            held_weights = await path_source.get_path_weights(
+                self.stability.contested(paths)
+            )
+            paths = self.stability.apply(paths, held_weights)
+        self.update_paths(paths, replay)
+        await self.reconciler.reconcile_async(replay)
+
+    def update_paths(self, paths, replay=False):
+        """Take the paths of this cycle, a dict of pair -> path, and update
+        the desired routes of the flows whose path changed.
+        """
+        if self.interfaces is not None:
+            paths = self.interfaces.resolve_paths(paths)
+        self.computed = paths
+        self.alternates.record(paths)
+        self.programmed = self.alternates.avoid(paths)
+        self.neighbor_pairs = {}
+        self.interface_pairs = {}
+        self.__index_first_hops(self.computed)
+        self.__index_first_hops(self.programmed)
+        self.__update_routes(self.programmed, replay)
+
+    def __index_first_hops(self, paths):
+        for pair, path in paths.items():
+            if not path:
+                continue
+            hop = path[0]
+            self.neighbor_pairs.setdefault(hop["ToInterfaceIP"], set()).add(pair)
+            if hop.get("FromInterfaceName"):
+                self.interface_pairs.setdefault(hop["FromInterfaceName"], set()).add(
+                    pair
+                )
+
+    def __update_routes(self, paths, replay=False, pairs=None):
+        """Update the desired routes of the flows whose path changed, out
+        of paths for all pairs, or only for pairs if given.
+        """
+        bindings = {}
+        if self.binding_sids is not None:
+            bindings = self.binding_sids.sync(
+                {
+                    pair: path_hops(path)
+                    for pair, path in self.programmed.items()
+                    if path
+                },
+                replay,
+            )
+        interned = {}
+        for pair, path in paths.items():
+            if not path:
+                continue
+            if pair in bindings:
+                hops = self.binding_sids.route_path(bindings[pair])
+            else:
+                hops = path_hops(path)
+            interned[pair] = self.path_table.intern(**hops)
+        changed = self.path_table.update(interned, pairs)
+        for pair in changed:
+            if self.path_table.get(pair) is None:
+                logging.warning("No path from %s to %s.", *pair)
+        desired_routes = []
+        withdrawn_routes = []
+        for flow, path in self.path_table.fan_out(changed):
+            if path is None:
+                withdrawn_routes.append(steered_route(flow, {}))
+                continue
+            vrf_settings = self.sl_api.vrf_settings(flow.get("vrfName", "default"))
+            desired_routes.append(
+                steered_route(flow, path._asdict(), vrf_settings["admin_distance"])
+            )
+        self.reconciler.update_desired(desired_routes)
+        self.reconciler.remove_desired(withdrawn_routes)
+        logging.info(
+            "%i of %i paths changed, %i flows affected. Steering %i of %i flows.",
+            len(changed),
+            len(self.path_table.paths),
+            len(desired_routes) + len(withdrawn_routes),
+            len(self.reconciler.desired),
+            len(self.flows),
+        )
+
+
+class RouterSteering:
+    """Steers flows through many headend routers of a RouterRegistry.
+    Flows are split by the router owning their srcGatewayIP, with one
+    SteeringEngine per router made by engine_factory(sl_api, flows).
+    Paths for all routers are computed together, then programmed on the
+    routers concurrently.
+    EOF is only sent to routers whose desired state was pushed, routers
+    failing their cycle get EOF after their next successful one.
+    Routers which cannot be registered on startup are registered with
+    restart_mode ("reconcile" or "replay") once they can, before their
+    first push.
+    """
+
+    def __init__(
+        self, registry, flows, engine_factory=SteeringEngine, restart_mode="reconcile"
+    ):
+        self.registry = registry
+        flows_by_router = {}
+        for flow in flows:
+            flows_by_router.setdefault(registry.key(flow["srcGatewayIP"]), []).append(
+                flow
+            )
+        self.engines = {
+            key: engine_factory(registry.sessions[key], router_flows)
+            for key, router_flows in flows_by_router.items()
+        }
+        self.restart_mode = restart_mode
+        # Routers whose last cycle failed, and routers still owed EOF.
+        self.failed = set()
+        self.eof_pending = set()
+        # Routers not registered yet, retried every cycle.
+        self.unregistered = set()
+
+    def register(self):
+        """Register every router, reading back the installed routes with
+        the "reconcile" restart mode. Failing routers are retried by
+        run_cycle() instead of aborting the others.
+        """
+        self.unregistered = self.__for_each(
+            lambda key, engine: self.__register(engine), raise_errors=False
+        )
+        for key in self.unregistered:
+            logging.warning(
+                "Deferring headend %s until it can be registered.", key or "default"
+            )
+        self.failed = set(self.unregistered)
+
+    def __register(self, engine):
+        engine.register()
+        if self.restart_mode == "reconcile":
+            engine.load_installed()
+
+    def eof(self):
+        """EOF to the routers whose last cycle pushed their desired state.
+        EOF to the others would purge the routes they never got.
+        """
+        for key in self.failed:
+            logging.warning(
+                "Deferring EOF for headend %s until its routes are pushed.",
+                key or "default",
+            )
+        self.eof_pending = set(self.failed)
+        self.__for_each(
+            lambda key, engine: engine.eof(),
+            keys=[key for key in self.engines if key not in self.failed],
+        )
+
+    def cleanup(self, timeout=10):
+        """Clean up every router concurrently, within timeout seconds."""
+        self.__for_each(lambda key, engine: engine.cleanup(timeout), raise_errors=False)
+
+    def gateway_pairs(self):
+        return list(
+            dict.fromkeys(
+                pair
+                for engine in self.engines.values()
+                for pair in engine.gateway_pairs()
+            )
+        )
+
+    def run_cycle(self, path_source, replay=False):
+        """One path query and one weights query for every router, then
+        concurrent programming. A failing router is logged and retried next
+        cycle, the other routers are still programmed.
+        """
+        paths = path_source.get_least_utilized_paths(self.gateway_pairs())
+        router_paths = {
+            key: {pair: paths.get(pair) for pair in engine.gateway_pairs()}
+            for key, engine in self.engines.items()
+        }
+        contested = {
+            (key, pair): path
+            for key, engine in self.engines.items()
+            for pair, path in engine.contested_paths(router_paths[key]).items()
+        }
+        held_weights = {key: {} for key in self.engines}
+        if contested:
+            for (key, pair), weights in path_source.get_path_weights(contested).items():
+                held_weights[key][pair] = weights
+        selected = {
+            key: engine.select_paths(router_paths[key], path_source, held_weights[key])
+            for key, engine in self.engines.items()
+        }
+        self.failed = self.__for_each(
+            lambda key, engine: self.__program(key, engine, selected[key], replay),
+            raise_errors=False,
+        )
+
+    def __program(self, key, engine, paths, replay):
+        if key in self.unregistered:
+            self.__register(engine)
+            self.unregistered.discard(key)
+            logging.info("Registered deferred headend %s.", key or "default")
+            replay = self.restart_mode == "replay"
+        engine.program(paths, replay)
+        if key in self.eof_pending:
+            engine.eof()
+            self.eof_pending.discard(key)
+
+    def __for_each(self, function, raise_errors=True, keys=None):
+        """Run function(key, engine) for the engines of keys (default all)
+        concurrently, returns the keys it failed for.
+        """
+        failed = set()
+
+        def run(key):
+            try:
+                function(key, self.engines[key])
+            except Exception:
+                logging.exception("Failed on headend %s.", key or "default")
+                failed.add(key)
+                if raise_errors:
+                    raise
+
+        self.registry.for_each(run, self.engines if keys is None else keys)
+        return failed
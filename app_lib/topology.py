@@ -0,0 +1,244 @@
+"""In-process snapshot of the Jalapeño topology.
+Loads the graph once and answers shortest path queries locally,
+only edge weights are refreshed from ArangoDB between computations.
+"""
+import array
+import heapq
+import logging
+import numbers
+import threading
+
+
+class TopologyCache:
+    """Compressed sparse row adjacency of the LSNode graph.
+    Outbound edges of node i are edge indexes offsets[i] to offsets[i + 1],
+    with sources, targets and weights held in flat arrays indexed by edge.
+    Provides the same path methods as Jalapeno. Every change and query
+    holds the lock, so it can be shared with the change feed thread.
+    """
+
+    NODES_QUERY = """
+    FOR n IN LSNode
+        RETURN n._key
+    """
+    EDGES_QUERY = """
+    FOR e IN @@graph
+        RETURN {
+            _id: e._id,
+            _from: e._from,
+            _to: e._to,
+            ToInterfaceIP: e.ToInterfaceIP,
+            FromInterfaceName: e.FromInterfaceName,
+            FromInterfaceIP: e.FromInterfaceIP,
+            RemotePrefixSID: e.RemotePrefixSID,
+            Weight: e[@weight]
+        }
+    """
+    WEIGHTS_QUERY = """
+    FOR e IN @@graph
+        RETURN [e._id, e[@weight]]
+    """
+    # Matches the ArangoDB SHORTEST_PATH defaultWeight for missing weights.
+    DEFAULT_WEIGHT = 1.0
+
+    def __init__(self, jalapeno):
+        self.jalapeno = jalapeno
+        self.node_keys = []
+        self.node_index = {}
+        self.offsets = array.array("l", [0])
+        self.sources = array.array("l")
+        self.targets = array.array("l")
+        self.weights = array.array("d")
+        # Edge fields handed back in paths, and edge _id -> edge index.
+        self.edges = []
+        self.edge_index = {}
+        # Shortest path tree per source node, valid until weights change.
+        self.trees = {}
+        # Held for every change and read of the arrays and trees.
+        self.lock = threading.RLock()
+
+    def load(self):
+        """Fetch the full topology and rebuild the adjacency arrays."""
+        bind_vars = {
+            "@graph": self.jalapeno.graph,
+            "weight": self.jalapeno.weight_attribute,
+        }
+        node_keys = list(self.jalapeno.db.aql.execute(self.NODES_QUERY))
+        edge_docs = list(
+            self.jalapeno.db.aql.execute(self.EDGES_QUERY, bind_vars=bind_vars)
+        )
+        node_index = {key: index for index, key in enumerate(node_keys)}
+        for doc in edge_docs:
+            for vertex in (doc["_from"], doc["_to"]):
+                key = vertex.split("/", 1)[1]
+                if key not in node_index:
+                    node_index[key] = len(node_keys)
+                    node_keys.append(key)
+        sources = [node_index[doc["_from"].split("/", 1)[1]] for doc in edge_docs]
+        counts = [0] * len(node_keys)
+        for source in sources:
+            counts[source] += 1
+        offsets = array.array("l", [0] * (len(node_keys) + 1))
+        for index, count in enumerate(counts):
+            offsets[index + 1] = offsets[index] + count
+        # Counting sort of the edges by source node.
+        cursor = list(offsets[:-1])
+        order = [0] * len(edge_docs)
+        for doc_index, source in enumerate(sources):
+            order[cursor[source]] = doc_index
+            cursor[source] += 1
+        targets = array.array("l", [0] * len(edge_docs))
+        edge_sources = array.array("l", [0] * len(edge_docs))
+        weights = array.array("d", [0.0] * len(edge_docs))
+        edges = [None] * len(edge_docs)
+        edge_index = {}
+        for position, doc_index in enumerate(order):
+            doc = edge_docs[doc_index]
+            edge_sources[position] = sources[doc_index]
+            targets[position] = node_index[doc["_to"].split("/", 1)[1]]
+            weights[position] = self.edge_weight(doc["Weight"])
+            edges[position] = {
+                "_id": doc["_id"],
+                "ToInterfaceIP": doc["ToInterfaceIP"],
+                "FromInterfaceName": doc["FromInterfaceName"],
+                "FromInterfaceIP": doc["FromInterfaceIP"],
+                "RemotePrefixSID": doc["RemotePrefixSID"],
+            }
+            edge_index[doc["_id"]] = position
+        with self.lock:
+            self.node_keys = node_keys
+            self.node_index = node_index
+            self.offsets = offsets
+            self.sources = edge_sources
+            self.targets = targets
+            self.weights = weights
+            self.edges = edges
+            self.edge_index = edge_index
+            self.trees = {}
+        logging.info(
+            "Loaded topology with %i nodes and %i edges.", len(node_keys), len(edges)
+        )
+
+    def refresh_weights(self):
+        """Fetch only the edge weights. Reloads the full topology if the
+        set of edges has changed. Returns True if any weight changed.
+        """
+        rows = list(
+            self.jalapeno.db.aql.execute(
+                self.WEIGHTS_QUERY,
+                bind_vars={
+                    "@graph": self.jalapeno.graph,
+                    "weight": self.jalapeno.weight_attribute,
+                },
+            )
+        )
+        with self.lock:
+            changed = False
+            reload = False
+            for edge_id, weight in rows:
+                position = self.edge_index.get(edge_id)
+                if position is None:
+                    logging.info("New edge %s in topology, reloading.", edge_id)
+                    reload = True
+                    break
+                weight = self.edge_weight(weight)
+                if self.weights[position] != weight:
+                    self.weights[position] = weight
+                    changed = True
+            if not reload and len(rows) != len(self.edges):
+                logging.info("Edges removed from topology, reloading.")
+                reload = True
+            if changed:
+                self.trees = {}
+        if reload:
+            self.load()
+            return True
+        return changed
+
+    def set_edge_weight(self, edge_id, weight):
+        """Apply a single edge weight change. Returns True if it changed."""
+        weight = self.edge_weight(weight)
+        with self.lock:
+            position = self.edge_index[edge_id]
+            if self.weights[position] == weight:
+                return False
+            self.weights[position] = weight
+            self.trees = {}
+            return True
+
+    def get_least_utilized_path(self, src_ip, dst_ip):
+        """Local equivalent of Jalapeno.get_least_utilized_path."""
+        with self.lock:
+            return self.__path(src_ip, dst_ip)
+
+    def get_least_utilized_paths(self, pairs):
+        """Local equivalent of Jalapeno.get_least_utilized_paths.
+        Pairs sharing a source share one shortest path tree.
+        """
+        with self.lock:
+            return {
+                (src_ip, dst_ip): self.__path(src_ip, dst_ip)
+                for src_ip, dst_ip in pairs
+            }
+
+    def get_path_weights(self, paths):
+        """Local equivalent of Jalapeno.get_path_weights."""
+        weights = {}
+        with self.lock:
+            for key, path in paths.items():
+                positions = [self.edge_index.get(edge["_id"]) for edge in path]
+                if None in positions:
+                    weights[key] = None
+                else:
+                    weights[key] = [self.weights[position] for position in positions]
+        return weights
+
+    def __path(self, src_ip, dst_ip):
+        """Walk the shortest path tree back from dst, [] if unreachable.
+        Called with the lock held, as is __dijkstra.
+        """
+        src = self.node_index.get(src_ip)
+        dst = self.node_index.get(dst_ip)
+        if src is None or dst is None:
+            return []
+        tree = self.trees.get(src)
+        if tree is None:
+            tree = self.trees[src] = self.__dijkstra(src)
+        path = []
+        node = dst
+        while node != src:
+            edge = tree[node]
+            if edge < 0:
+                return []
+            path.append(dict(self.edges[edge], Weight=self.weights[edge]))
+            node = self.sources[edge]
+        path.reverse()
+        return path
+
+    def __dijkstra(self, src):
+        """Heap-based Dijkstra, returns the edge used to reach each node."""
+        offsets = self.offsets
+        targets = self.targets
+        weights = self.weights
+        distance = [float("inf")] * len(self.node_keys)
+        via_edge = array.array("l", [-1] * len(self.node_keys))
+        distance[src] = 0.0
+        heap = [(0.0, src)]
+        while heap:
+            node_distance, node = heapq.heappop(heap)
+            if node_distance > distance[node]:
+                continue
+            for edge in range(offsets[node], offsets[node + 1]):
+                target = targets[edge]
+                target_distance = node_distance + weights[edge]
+                if target_distance < distance[target]:
+                    distance[target] = target_distance
+                    via_edge[target] = edge
+                    heapq.heappush(heap, (target_distance, target))
+        return via_edge
+
+    def edge_weight(self, weight):
+        """Normalize a weight attribute value as SHORTEST_PATH would."""
+        if isinstance(weight, numbers.Number) and not isinstance(weight, bool):
+            return float(weight)
+        return self.DEFAULT_WEIGHT